@@ -0,0 +1,164 @@
+# =============================================================================
+# Node store of the monte carlo tree.
+#
+# The nodes are rows of parallel typed arrays instead of Python objects, a
+# node is only its index in the arrays.  The children of a node are a block
+# of consecutive rows allocated the first time the node is expanded, one row
+# for every legal move in a random order, the first `expanded` rows of the
+# block are the children already in the tree and the rest are the untried
+# moves, so expanding a node takes the next row.  The boards are not stored,
+# they are played again from the root board with the moves of the nodes.  The
+# wins are floats since a truncated rollout scores a game with its expected
+# result.
+# =============================================================================
+from array import array
+
+ROOT = 0
+
+
+class NodeArena:
+    __slots__ = ("move", "parent", "first", "count", "expanded", "visits", "wins", "amaf_visits", "amaf_wins")
+
+    def __init__(self, root_move=-1, rave=False):
+        """
+
+        :param root_move: move that led to the root state, -1 if none
+        :param rave: True to keep the all moves as first statistics
+        """
+        self.move = array("b", [root_move])
+        self.parent = array("i", [-1])
+        self.first = array("i", [-1])
+        self.count = array("B", [0])
+        self.expanded = array("B", [0])
+        self.visits = array("i", [1])
+        self.wins = array("f", [0])
+        self.amaf_visits = array("i", [0]) if rave else None
+        self.amaf_wins = array("f", [0]) if rave else None
+
+    def __len__(self):
+        """
+
+        :return: number of rows, the children not expanded yet included
+        """
+        return len(self.move)
+
+    def allocated(self, node):
+        """
+
+        :param node: node index
+        :return: True if the children block of the node exists
+        """
+        return self.first[node] >= 0
+
+    def allocate(self, node, moves):
+        """
+        add the block of children of a node, one row for every move
+        :param node: node index
+        :param moves: legal moves of the node, empty if the game is decided
+        :return: nothing
+        """
+        size = len(moves)
+        self.first[node] = len(self.move)
+        self.count[node] = size
+        self.move.extend(moves)
+        self.parent.extend([node] * size)
+        self.first.extend([-1] * size)
+        self.count.extend(bytes(size))
+        self.expanded.extend(bytes(size))
+        self.visits.extend([1] * size)
+        self.wins.extend([0] * size)
+        if self.amaf_visits is not None:
+            self.amaf_visits.extend([0] * size)
+            self.amaf_wins.extend([0] * size)
+
+    def fully_expanded(self, node):
+        """
+
+        :param node: node index
+        :return: True if every child of the node is in the tree
+        """
+        return self.expanded[node] == self.count[node]
+
+    def children(self, node):
+        """
+
+        :param node: node index
+        :return: range of the children in the tree
+        """
+        first = self.first[node]
+        return range(first, first + self.expanded[node]) if first >= 0 else range(0)
+
+    def expand(self, node):
+        """
+        add the next child that is not in the tree yet, the blocks are shuffled when allocated
+        :param node: node index
+        :return: index of the new child
+        """
+        child = self.first[node] + self.expanded[node]
+        self.expanded[node] += 1
+        return child
+
+    def subtree(self, node):
+        """
+        copy the subtree of a node to a new arena
+        :param node: index of the new root
+        :return: the new arena
+        """
+        arena = NodeArena(self.move[node], self.amaf_visits is not None)
+        columns = [name for name in ("visits", "wins", "amaf_visits", "amaf_wins") if getattr(self, name) is not None]
+        for name in columns:
+            getattr(arena, name)[ROOT] = getattr(self, name)[node]
+        old = [node]
+        for new, source in enumerate(old):
+            if not self.allocated(source):
+                continue
+            first, count = self.first[source], self.count[source]
+            arena.allocate(new, self.move[first:first + count])
+            arena.expanded[new] = self.expanded[source]
+            start = arena.first[new]
+            for name in columns:
+                getattr(arena, name)[start:start + count] = getattr(self, name)[first:first + count]
+            old.extend(range(first, first + count))
+        return arena
+
+    def evict(self, target):
+        """
+        remove the subtrees with the least visits until at most target rows are left, the statistics of a
+        removed subtree are already counted in its root since every visit of a node passes through its parent
+        :param target: number of rows to keep
+        :return: the compacted arena
+        """
+        # rows under every node, a child block is always allocated after its parent row
+        size = array("i", self.count)
+        parent = self.parent
+        for node in range(len(self.move) - 1, ROOT, -1):
+            size[parent[node]] += size[node]
+        removed = bytearray(len(self.move))
+        candidates = sorted((node for node in range(1, len(self.move)) if self.first[node] >= 0),
+                            key=lambda node: (self.visits[node], -node))
+        for node in candidates:
+            if size[ROOT] + 1 <= target:
+                break
+            ancestor = parent[node]
+            while ancestor > ROOT and not removed[ancestor]:
+                ancestor = parent[ancestor]
+            if removed[ancestor]:
+                continue
+            freed = size[node]
+            ancestor = parent[node]
+            while ancestor >= ROOT:
+                size[ancestor] -= freed
+                ancestor = parent[ancestor]
+            removed[node] = 1
+            self.first[node] = -1
+            self.count[node] = 0
+            self.expanded[node] = 0
+        return self.subtree(ROOT)
+
+    def nbytes(self):
+        """
+
+        :return: bytes used by the items of the arrays
+        """
+        columns = [getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None]
+        return sum(len(column) * column.itemsize for column in columns)
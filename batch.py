@@ -0,0 +1,158 @@
+# =============================================================================
+# Random playouts of many games at once with numpy.
+#
+# Every game of the batch is a row of the arrays:
+#   boards  (games, 81) 0 empty, 1 X, 2 O, same indices as the string state
+#   boxes   (games, 9)  status of the small boxes, 0 open, 1 X, 2 O, 3 draw
+#   last    (games,)    last move played, -1 if none
+#   side    (games,)    1 if X is to move, 2 if O is to move
+# and all the games that are not decided move together every step.
+# While playing, every box of every game is kept as the 9 bit masks of its X,
+# O and empty cells, a random move is a random set bit of the empty mask of
+# the forced box found in a table, and the box and game status are looked up
+# in the win table, so a step only touches one box of every game.
+# numpy is only needed by this module.
+# =============================================================================
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from boxtable import FULL_BOX, LINES, WIN, string_status
+
+CODES = {".": 0, "X": 1, "O": 2, "D": 3}
+
+
+class BatchPlayout:
+    def __init__(self, seed=None):
+        """
+
+        :param seed: seed of the random moves
+        """
+        if np is None:
+            raise ImportError("numpy is needed for the batch playouts")
+        self.rng = np.random.default_rng(seed)
+        self.macro_lines = np.array(LINES)
+        # for every 9 bit mask the number of set bits, the set bits in order and if it holds a line
+        self.count = np.array([bin(mask).count("1") for mask in range(512)], dtype=np.int64)
+        self.pick = np.array([[i for i in range(9) if mask >> i & 1] + [0] * (9 - bin(mask).count("1"))
+                              for mask in range(512)], dtype=np.int64)
+        self.win = np.frombuffer(bytes(WIN), dtype=np.uint8).astype(bool)
+
+    def start(self, games, state="." * 81, last_move=-1, player="X"):
+        """
+
+        :param games: number of games
+        :param state: 81 characters state every game starts from
+        :param last_move: last move played
+        :param player: player to move
+        :return: the arrays of the games (boards, boxes, last, side)
+        """
+        board = np.array([CODES[c] for c in state], dtype=np.int8)
+        box = np.array([CODES[string_status(state[b * 9: b * 9 + 9])] for b in range(9)], dtype=np.int8)
+        return (np.tile(board, (games, 1)), np.tile(box, (games, 1)),
+                np.full(games, last_move, dtype=np.int64), np.full(games, CODES[player], dtype=np.int8))
+
+    def run(self, boards, boxes, last, side, moves=None):
+        """
+        play random moves in all the games until they are decided, the arrays are changed in place
+        :param boards: boards of the games
+        :param boxes: small boxes status of the games
+        :param last: last move of the games
+        :param side: player to move in the games
+        :param moves: optional (games, 81) array that gets the moves of every game, -1 after the end
+        :return: result of every game, 1 X won, 2 O won, 3 draw
+        """
+        bits = np.left_shift(1, np.arange(9, dtype=np.int16))
+        cells = boards.reshape(len(boards), 9, 9)
+        # the masks of every box, rows are [X, O] so a player indexes its own masks with side - 1
+        masks = np.stack([((cells == 1) * bits).sum(axis=2), ((cells == 2) * bits).sum(axis=2)]).astype(np.int16)
+        empty = ((cells == 0) * bits).sum(axis=2).astype(np.int16)
+        macro = np.stack([((boxes == 1) * bits).sum(axis=1), ((boxes == 2) * bits).sum(axis=1)]).astype(np.int16)
+        closed = ((boxes != 0) * bits).sum(axis=1).astype(np.int16)
+        empty[(boxes != 0)] = 0
+        results = self.status(boxes)
+        active = np.nonzero(results == 0)[0]
+        ply = 0
+        while len(active):
+            b_last = last[active]
+            forced = b_last % 9
+            free = (b_last < 0) | ((closed[active] >> forced) & 1 == 1)
+            box = forced.copy()
+            rank = self.rng.random(len(active))
+            if free.any():
+                # a box with a chance proportional to its empty cells gives every legal move the same chance
+                rows = active[free]
+                counts = self.count[empty[rows]]
+                cumulative = counts.cumsum(axis=1)
+                pick = (rank[free] * cumulative[:, -1]).astype(np.int64)
+                box[free] = (cumulative <= pick[:, None]).sum(axis=1)
+            box_empty = empty[active, box]
+            # the rank of the move among the empty cells of its box
+            index = (rank * self.count[box_empty]).astype(np.int64)
+            if free.any():
+                chosen = box[free]
+                index[free] = pick - cumulative[np.arange(len(rows)), chosen] + counts[np.arange(len(rows)), chosen]
+            cell = self.pick[box_empty, index]
+            move = box * 9 + cell
+            player = side[active]
+            boards[active, move] = player
+            if moves is not None:
+                moves[active, ply] = move
+            ply += 1
+            bit = bits[cell]
+            own = masks[player - 1, active, box] | bit
+            masks[player - 1, active, box] = own
+            empty[active, box] = box_empty & ~bit
+            last[active] = move
+            side[active] = 3 - player
+            # only the games where the box was closed can be decided
+            won = self.win[own]
+            done = won | (box_empty == bit)
+            if done.any():
+                rows, box, player, won = active[done], box[done], player[done], won[done]
+                boxes[rows, box] = np.where(won, player, 3)
+                empty[rows, box] = 0
+                closed[rows] |= bits[box]
+                # macro[player - 1, rows] gets the box only where it was won
+                own_macro = macro[player - 1, rows] | np.where(won, bits[box], 0).astype(np.int16)
+                macro[player - 1, rows] = own_macro
+                results[rows] = np.where(won & self.win[own_macro], player,
+                                         np.where(closed[rows] == FULL_BOX, 3, 0))
+                active = active[results[active] == 0]
+        return results
+
+    def status(self, boxes):
+        """
+
+        :param boxes: small boxes status of the games
+        :return: status of every game, 0 not decided, 1 X won, 2 O won, 3 draw
+        """
+        lines = boxes[:, self.macro_lines]
+        x_won = (lines == 1).all(axis=2).any(axis=1)
+        o_won = (lines == 2).all(axis=2).any(axis=1)
+        full = (boxes != 0).all(axis=1)
+        return np.where(x_won, 1, np.where(o_won, 2, np.where(full, 3, 0))).astype(np.int8)
+
+    def counts(self, games, state, last_move, player):
+        """
+
+        :param games: number of games
+        :param state: 81 characters state to play from
+        :param last_move: last move played
+        :param player: player to move
+        :return: the number of games won by X, won by O and drawn
+        """
+        results = self.run(*self.start(games, state, last_move, player))
+        x_won, o_won, draws = np.bincount(results, minlength=4)[1:]
+        return int(x_won), int(o_won), int(draws)
+
+    def self_play(self, games):
+        """
+        play random games from the empty board
+        :param games: number of games
+        :return: (games, 81) array of the moves of every game, -1 after the end, and the results
+        """
+        moves = np.full((games, 81), -1, dtype=np.int8)
+        results = self.run(*self.start(games), moves=moves)
+        return moves, results
@@ -0,0 +1,540 @@
+# =============================================================================
+# Benchmarks of the search engines on a fixed set of positions.
+#
+# run with:  python benchmarks.py <benchmark> [arguments]
+# =============================================================================
+import contextlib
+import io
+import random
+import sys
+import tracemalloc
+from time import time
+
+from batch import BatchPlayout
+from bitboard import BitBoard
+from boxtable import string_status
+from endgame import EndgameSolver
+from heuristics import heuristics
+from monte import MCTS, playout
+from movegen import perft
+from ordering import MoveOrderer
+from playout import Playout
+from symmetry import canonical_key
+from transposition import TranspositionTable
+from uttt2 import ultiTic
+
+
+def fixed_positions(count=10, seed=2020, min_moves=4, max_moves=24):
+    """
+
+    :param count: number of positions
+    :param seed: seed of the random games the positions are taken from
+    :param min_moves: least moves played in a position
+    :param max_moves: most moves played in a position
+    :return: list of (state, last_move, player) of positions that are not decided
+    """
+    rand = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = BitBoard()
+        for i in range(rand.randint(min_moves, max_moves)):
+            if board.status() != ".":
+                break
+            board.make(rand.choice(board.possible_moves()))
+        if board.status() == ".":
+            positions.append((board.to_string(), board.last_move, board.player))
+    return positions
+
+
+def ordering_benchmark(depth=4, count=10):
+    """
+    compare the minimax node count without and with move ordering
+    :param depth: minimax depth
+    :param count: number of positions
+    :return: nothing
+    """
+    depth, count = int(depth), int(count)
+    eval = heuristics(depth).h1
+    for name, orderer in (("tt move only", None), ("move ordering", MoveOrderer())):
+        game = ultiTic(None, None, "." * 81)
+        game.orderer = orderer
+        nodes = 0
+        start = time()
+        for state, last_move, player in fixed_positions(count):
+            game.box_won = game.update_box_won(state)
+            game.minimax(state, last_move, player, depth, eval)
+            nodes += game.nodes
+        print(name, "nodes:", nodes, "time: %.2f" % (time() - start))
+
+
+def tt_benchmark(depths="5,6,7", count=5):
+    """
+    compare the minimax node count without and with the transposition table and print the table counters
+    :param depths: comma separated minimax depths
+    :param count: number of positions
+    :return: nothing
+    """
+    count = int(count)
+    for depth in map(int, str(depths).split(",")):
+        eval = heuristics(depth).h1
+        for name, enabled in (("no table", False), ("transposition table", True)):
+            game = ultiTic(None, None, "." * 81)
+            game.tt = TranspositionTable(enabled=enabled)
+            nodes = 0
+            totals = dict()
+            start = time()
+            for state, last_move, player in fixed_positions(count):
+                game.minimax(state, last_move, player, depth, eval)
+                nodes += game.nodes
+                for counter, value in game.tt.stats().items():
+                    totals[counter] = totals.get(counter, 0) + value
+            print("depth %d" % depth, name, "nodes:", nodes, "time: %.2f" % (time() - start))
+            if enabled:
+                probes = totals["hits"] + totals["misses"]
+                totals["hit_rate"] = round(totals["hits"] / probes, 3) if probes else 0.0
+                print("depth %d" % depth, "table stats:", totals)
+
+
+def string_playout(game, state, last_move, player):
+    """
+    random game played on the string state like MCTS.simulate did before the bit board
+    :param game: game object
+    :param state: state to play from
+    :param last_move: last move played
+    :param player: player to move
+    :return: which player won
+    """
+    game_won = game.check_small_box(game.update_box_won(state))
+    while game_won == ".":
+        last_move = game.random_move(state, last_move)
+        state = game.add_piece(state, last_move, player)
+        player = game.opponent(player)
+        game_won = game.check_small_box(game.update_box_won(state))
+    return game_won
+
+
+def bitboard_playout(state, last_move, player):
+    """
+    random game played with make on a bit board
+    :param state: state to play from
+    :param last_move: last move played
+    :param player: player to move
+    :return: which player won
+    """
+    board = BitBoard(state, last_move, player)
+    while board.status() == ".":
+        board.make(random.choice(board.possible_moves()))
+    return board.status()
+
+
+def playout_benchmark(games=2000):
+    """
+    compare the playouts per second of the string rollouts, the bit board and the playout engine
+    :param games: number of playouts from every position
+    :return: nothing
+    """
+    games = int(games)
+    positions = fixed_positions(5, min_moves=0, max_moves=10)
+    game = ultiTic(None, None, "." * 81)
+    engine = Playout()
+    runs = (("string state", lambda s, m, p: string_playout(game, s, m, p)),
+            ("bit board", bitboard_playout),
+            ("playout engine", lambda s, m, p: playout(s, m, p, engine)))
+    for name, run in runs:
+        start = time()
+        for state, last_move, player in positions:
+            game.box_won = game.update_box_won(state)
+            for i in range(games):
+                run(state, last_move, player)
+        print(name, "playouts per second: %.0f" % (games * len(positions) / (time() - start)))
+
+
+def batch_benchmark(games=20000):
+    """
+    compare the playouts per second of the playout engine and the numpy batch playouts
+    :param games: number of playouts from every position
+    :return: nothing
+    """
+    games = int(games)
+    positions = fixed_positions(5, min_moves=0, max_moves=10)
+    engine = Playout()
+    start = time()
+    for state, last_move, player in positions:
+        for i in range(games):
+            playout(state, last_move, player, engine)
+    print("playout engine playouts per second: %.0f" % (games * len(positions) / (time() - start)))
+    batch = BatchPlayout()
+    start = time()
+    for state, last_move, player in positions:
+        batch.counts(games, state, last_move, player)
+    print("numpy batch playouts per second: %.0f" % (games * len(positions) / (time() - start)))
+    start = time()
+    batch.self_play(games)
+    print("numpy self play games per second: %.0f" % (games / (time() - start)))
+
+
+def memory_benchmark(iterations=5000, budget=0):
+    """
+    measure the bytes used by every node of a monte carlo tree
+    :param iterations: iterations of the search
+    :param budget: most rows of the tree, no limit if 0
+    :return: nothing
+    """
+    iterations, budget = int(iterations), int(budget)
+    state, last_move, player = fixed_positions(1)[0]
+    game = ultiTic(None, None, "." * 81)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = MCTS(state, game, last_move, player, iterations, node_budget=budget or None)
+    tree.solve()
+    used, peak = tracemalloc.get_traced_memory()
+    used -= before
+    tracemalloc.stop()
+    nodes = 1 + sum(tree.arena.expanded)
+    print("nodes:", nodes, "rows:", len(tree.arena), "arrays bytes:", tree.arena.nbytes())
+    print("bytes per node: %.1f" % (used / nodes), "peak bytes: %d" % (peak - before))
+
+
+def monte_match(first, second, games, seed=0):
+    """
+    play monte carlo players against each other, they switch sides every game
+    :param first: settings of the first player for pre_monte
+    :param second: settings of the second player for pre_monte
+    :param games: number of games
+    :param seed: seed of the first game
+    :return: score of the first player, 1 for a win and 0.5 for a draw
+    """
+    score = 0
+    for i in range(games):
+        random.seed(seed + i)
+        players = (first, second) if i % 2 == 0 else (second, first)
+        game = ultiTic(players[0], players[1], "." * 81)
+        with contextlib.redirect_stdout(io.StringIO()):
+            winner = game.game(game.pre_monte, game.pre_monte, True)
+        if winner == "Z":
+            score += 0.5
+        elif (winner == "X") == (i % 2 == 0):
+            score += 1
+    return score
+
+
+def rave_benchmark(games=20, plain=400, rave=5):
+    """
+    iterations to strength: RAVE with fewer iterations against plain UCT with a fixed number of iterations
+    :param games: games of every match
+    :param plain: iterations of the plain UCT player
+    :param rave: equivalence parameter of the RAVE player
+    :return: nothing
+    """
+    games, plain, rave = int(games), int(plain), float(rave)
+    for iterations in (plain // 4, plain // 2, plain):
+        start = time()
+        score = monte_match((iterations, 0.2, {"rave": rave}), (plain, 0.2), games)
+        print("RAVE %d iterations against UCT %d iterations: %.1f / %d" % (iterations, plain, score, games),
+              "time: %.1f" % (time() - start))
+
+
+def eval_benchmark(count=200, rounds=5):
+    """
+    compare the evaluations per second of the heuristics without and with the box caches,
+    the scores must be the same
+    :param count: number of positions
+    :param rounds: times every position is evaluated
+    :return: nothing
+    """
+    count, rounds = int(count), int(rounds)
+    game = ultiTic(None, None, "." * 81)
+    boards = [BitBoard(state, last_move, player) for state, last_move, player in fixed_positions(count, max_moves=40)]
+    for h, name in (("1", "h1"), ("2", "evaluate2"), ("3", "evaluateBlocking")):
+        scores = []
+        for cache in (False, True):
+            eval = heuristics(0, cache).get_heur(h)
+            start = time()
+            for i in range(rounds):
+                values = [eval(game, board, board.last_move, player) for board in boards for player in "XO"]
+            print(name, "cache" if cache else "no cache",
+                  "evaluations per second: %.0f" % (rounds * len(values) / (time() - start)))
+            scores.append(values)
+        if scores[0] != scores[1]:
+            print(name, "the cached scores are different")
+
+
+def leaf_scores(game, board, depth, eval, player, scores):
+    """
+    score every leaf of a full tree like a search does without pruning
+    :param game: game object
+    :param board: bit board to search from
+    :param depth: depth of the tree
+    :param eval: evaluation function
+    :param player: player the leaves are scored for
+    :param scores: list that gets the scores
+    :return: nothing
+    """
+    if depth == 0 or board.status() != ".":
+        scores.append(eval(game, board, board.last_move, player))
+        return
+    for move in board.possible_moves():
+        board.make(move)
+        leaf_scores(game, board, depth - 1, eval, player, scores)
+        board.unmake()
+
+
+def incremental_benchmark(depth=3, count=5):
+    """
+    compare the cost of a leaf evaluation of h1 and h2 with the box caches and with the incremental scores,
+    the scores must be the same
+    :param depth: depth of the trees
+    :param count: number of positions
+    :return: nothing
+    """
+    depth, count = int(depth), int(count)
+    game = ultiTic(None, None, "." * 81)
+    positions = fixed_positions(count, max_moves=40)
+    for h, name in (("1", "h1"), ("2", "evaluate2")):
+        results = []
+        for incremental in (False, True):
+            eval = heuristics(depth, incremental=incremental).get_heur(h)
+            scores = []
+            start = time()
+            for state, last_move, player in positions:
+                leaf_scores(game, BitBoard(state, last_move, player), depth, eval, player, scores)
+            print(name, "incremental" if incremental else "full", "leaves: %d" % len(scores),
+                  "evaluations per second: %.0f" % (len(scores) / (time() - start)))
+            results.append(scores)
+        if results[0] != results[1]:
+            print(name, "the incremental scores are different")
+
+
+def reference_moves(state, last_move):
+    """
+    legal moves found by scanning the cells of the string state
+    :param state: 81 characters state
+    :param last_move: last move played, -1 if none
+    :return: list of the legal moves
+    """
+    box_won = [string_status(state[b * 9: b * 9 + 9]) for b in range(9)]
+    if last_move >= 0 and box_won[last_move % 9] == ".":
+        return [i for i in range(last_move % 9 * 9, last_move % 9 * 9 + 9) if state[i] == "."]
+    return [i for i in range(81) if state[i] == "." and box_won[i // 9] == "."]
+
+
+def reference_perft(state, last_move, player, depth):
+    """
+
+    :param state: 81 characters state
+    :param last_move: last move played, -1 if none
+    :param player: player to move
+    :param depth: number of moves
+    :return: number of leaf positions found with the string states
+    """
+    if depth == 0:
+        return 1
+    if string_status([string_status(state[b * 9: b * 9 + 9]) for b in range(9)]) != ".":
+        return 0
+    opponent = "O" if player == "X" else "X"
+    return sum(reference_perft(state[:m] + player + state[m + 1:], m, opponent, depth - 1)
+               for m in reference_moves(state, last_move))
+
+
+def perft_benchmark(depth=4, count=5):
+    """
+    count the leaves to the depth from the empty board and from fixed positions, check them
+    against the string move generation and measure the leaves per second
+    :param depth: number of moves
+    :param count: number of fixed positions
+    :return: nothing
+    """
+    depth, count = int(depth), int(count)
+    positions = [("." * 81, -1, "X")] + fixed_positions(count, max_moves=50)
+    for state, last_move, player in positions:
+        board = BitBoard(state, last_move, player)
+        counts = []
+        start = time()
+        for d in range(1, depth + 1):
+            counts.append(perft(board, d))
+        elapsed = time() - start
+        check = [reference_perft(state, last_move, player, d) for d in range(1, min(depth, 3) + 1)]
+        print("perft", counts, "leaves per second: %.0f" % (sum(counts) / elapsed),
+              "ok" if counts[:len(check)] == check else "different from the string moves %s" % check)
+
+
+def symmetry_benchmark(depth=3):
+    """
+    count the distinct positions after every number of moves from the empty board,
+    without and with the symmetric positions merged
+    :param depth: number of moves
+    :return: nothing
+    """
+    depth = int(depth)
+    board = BitBoard()
+    level = {board.key(): board}
+    for ply in range(1, depth + 1):
+        children = dict()
+        for parent in level.values():
+            for move in parent.possible_moves():
+                child = parent.copy()
+                child.make(move)
+                children[child.key()] = child
+        level = children
+        start = time()
+        canonical = set(canonical_key(child)[0] for child in level.values())
+        print("moves: %d" % ply, "positions: %d" % len(level), "canonical positions: %d" % len(canonical),
+              "canonical keys per second: %.0f" % (len(level) / (time() - start)))
+
+
+def brute_force_value(board):
+    """
+    win/draw/loss value of a position by searching every move to the end, without pruning or tables
+    :param board: bit board
+    :return: 1 if the player to move wins, 0 for a draw, -1 if the player to move loses
+    """
+    result = board.status()
+    if result != ".":
+        return 0 if result == "D" else -1
+    best = -1
+    for move in board.possible_moves():
+        board.make(move)
+        best = max(best, -brute_force_value(board))
+        board.unmake()
+        if best == 1:
+            break
+    return best
+
+
+def endgame_check(count=50, max_empty=11, seed=2020):
+    """
+    check the solver values and moves against the brute force values on positions of random games
+    :param count: number of positions
+    :param max_empty: most empty cells of the positions
+    :param seed: seed of the random games
+    :return: number of positions where the solver is wrong
+    """
+    rand = random.Random(seed)
+    solver = EndgameSolver(max_empty, node_limit=0)
+    checked = wrong = 0
+    while checked < count:
+        board = BitBoard()
+        while board.status() == "." and checked < count:
+            if solver.applies(board):
+                value, move = solver.solve(board)
+                board.make(move)
+                kept = 0 if board.status() == "D" else 1 if board.status() != "." else -brute_force_value(board)
+                board.unmake()
+                wrong += value != brute_force_value(board) or kept != value
+                checked += 1
+            board.make(rand.choice(board.possible_moves()))
+    return wrong
+
+
+def endgame_benchmark(count=20, depth=4, max_empty=16, check=400):
+    """
+    check the exact solver against a brute force search on positions with at most 11 empty cells, then
+    compare it with minimax on late positions, a minimax move is wrong when it gives a worse value than
+    the solved one
+    :param count: number of positions
+    :param depth: minimax depth
+    :param max_empty: most empty cells of the positions
+    :param check: number of positions checked against the brute force search
+    :return: nothing
+    """
+    count, depth, max_empty, check = int(count), int(depth), int(max_empty), int(check)
+    start = time()
+    wrong = endgame_check(check)
+    print("brute force check positions: %d" % check, "wrong solver values or moves: %d" % wrong,
+          "time: %.2f" % (time() - start))
+    solver = EndgameSolver(max_empty, node_limit=0)
+    positions = [p for p in fixed_positions(20 * count, min_moves=40, max_moves=70)
+                 if solver.applies(BitBoard(*p))][:count]
+    game = ultiTic(None, None, "." * 81)
+    eval = heuristics(depth).h1
+    solve_time = search_time = 0
+    wrong = 0
+    for state, last_move, player in positions:
+        start = time()
+        value, move = EndgameSolver(max_empty, node_limit=0).solve_state(state, last_move, player)
+        solve_time += time() - start
+        start = time()
+        move = game.minimax(state, last_move, player, depth, eval)
+        search_time += time() - start
+        board = BitBoard(state, last_move, player)
+        board.make(move)
+        if board.status() == ".":
+            searched = -EndgameSolver(max_empty, node_limit=0).solve(board)[0]
+        else:
+            searched = 0 if board.status() == "D" else 1
+        wrong += searched < value
+    print("positions: %d" % len(positions), "solver: %.3fs" % solve_time,
+          "minimax depth %d: %.3fs" % (depth, search_time), "wrong minimax moves: %d" % wrong)
+
+
+def expectimax_benchmark(depth=4, count=10, heuristic="1"):
+    """
+    compare the expectimax node count without and with the Star1/Star2 cuts of the chance nodes,
+    the moves have to be the same
+    :param depth: expectimax depth
+    :param count: number of positions
+    :param heuristic: heuristic number
+    :return: nothing
+    """
+    depth, count = int(depth), int(count)
+    eval = heuristics(depth).get_heur(heuristic)
+    positions = fixed_positions(count, max_moves=50)
+    # fill the box caches of the heuristic first so both searches find them full
+    warm = ultiTic(None, None, "." * 81)
+    for state, last_move, player in positions:
+        warm.expectimax(state, last_move, player, depth, eval)
+    moves = dict()
+    for name, pruning in (("full average", False), ("star pruning", True)):
+        game = ultiTic(None, None, "." * 81)
+        game.chance_pruning = pruning
+        nodes = 0
+        start = time()
+        moves[name] = []
+        for state, last_move, player in positions:
+            moves[name].append(game.expectimax(state, last_move, player, depth, eval))
+            nodes += game.nodes
+        print(name, "nodes:", nodes, "time: %.2f" % (time() - start))
+    print("same moves" if len(set(map(tuple, moves.values()))) == 1 else "different moves")
+
+
+def parallel_benchmark(depth=3, count=6, workers=2):
+    """
+    compare the moves of the serial and the parallel root search of minimax and expectimax, with and
+    without move ordering and chance pruning, the moves have to be the same
+    :param depth: search depth
+    :param count: number of positions
+    :param workers: number of processes
+    :return: nothing
+    """
+    depth, count, workers = int(depth), int(count), int(workers)
+    eval = heuristics(depth).h1
+    positions = fixed_positions(count, max_moves=50)
+    for orderer, pruning in ((MoveOrderer(), True), (None, False)):
+        game = ultiTic(None, None, "." * 81)
+        game.orderer = orderer
+        game.chance_pruning = pruning
+        for name, search in (("minimax", game.minimax), ("expectimax", game.expectimax)):
+            moves = dict()
+            for processes in (1, workers):
+                start = time()
+                moves[processes] = [search(state, last_move, player, depth, eval, processes)
+                                    for state, last_move, player in positions]
+                print(name, "ordering" if orderer else "no ordering", "pruning" if pruning else "no pruning",
+                      "processes: %d" % processes, "time: %.2f" % (time() - start))
+            print("same moves" if moves[1] == moves[workers] else "different moves")
+        for pool, shared_alpha in game.pools.values():
+            pool.shutdown()
+
+
+BENCHMARKS = {"ordering": ordering_benchmark, "tt": tt_benchmark, "playouts": playout_benchmark, "batch": batch_benchmark,
+              "memory": memory_benchmark, "rave": rave_benchmark,
+              "eval": eval_benchmark, "incremental": incremental_benchmark,
+              "perft": perft_benchmark, "symmetry": symmetry_benchmark,
+              "endgame": endgame_benchmark, "expectimax": expectimax_benchmark,
+              "parallel": parallel_benchmark}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("choose a benchmark:", ", ".join(BENCHMARKS))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
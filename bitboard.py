@@ -0,0 +1,277 @@
+# =============================================================================
+# Bit board representation of a game state.
+#
+# Every player owns an 81 bit mask, bit i is set when the player has a piece on
+# index i of the string board (see the board drawn in uttt2.py), so the cells
+# of small box b are the bits b*9 .. b*9+8.
+# The boxes won by every player are kept in a 9 bit macro mask and the drawn
+# boxes in another 9 bit mask.
+# The string form is only used for input/output.
+# =============================================================================
+from boxtable import FULL_BOX, LINE_MASKS, LINES, OPEN, DRAW, STATUS, STATUS_CHARS, WIN, macro_status
+from movegen import legal_mask, move_list
+from transposition import FORCED_KEYS, PIECE_KEYS, SIDE_KEY
+
+PLAYERS = "XO"
+
+box_strings = {}
+
+
+def box_string(x, o):
+    """
+
+    :param x: 9 bit mask of X in a box
+    :param o: 9 bit mask of O in a box
+    :return: the 9 characters string of the box
+    """
+    key = x | (o << 9)
+    if key not in box_strings:
+        box_strings[key] = "".join("X" if x >> i & 1 else "O" if o >> i & 1 else "." for i in range(9))
+    return box_strings[key]
+
+
+class BitBoard:
+    def __init__(self, state="." * 81, last_move=-1, player=None):
+        """
+
+        :param state: string state to build the board from
+        :param last_move: last move played
+        :param player: player to move, found from the pieces if None
+        """
+        self.pieces = [0, 0]
+        self.hash = 0
+        for i in range(81):
+            if state[i] in PLAYERS:
+                self.pieces[PLAYERS.index(state[i])] |= 1 << i
+                self.hash ^= PIECE_KEYS[PLAYERS.index(state[i])][i]
+        if player is None:
+            if last_move >= 0 and state[last_move] in PLAYERS:
+                player = "O" if state[last_move] == "X" else "X"
+            else:
+                player = "X" if state.count("X") <= state.count("O") else "O"
+        self.side = PLAYERS.index(player)
+        if self.side:
+            self.hash ^= SIDE_KEY
+        self.last_move = last_move
+        self.macro = [0, 0]
+        self.drawn = 0
+        self.result = "."
+        self.history = []
+        self.update_macro()
+
+    def copy(self):
+        """
+
+        :return: a copy of the board without the move history
+        """
+        board = BitBoard.__new__(BitBoard)
+        board.pieces = list(self.pieces)
+        board.hash = self.hash
+        board.side = self.side
+        board.last_move = self.last_move
+        board.macro = list(self.macro)
+        board.drawn = self.drawn
+        board.result = self.result
+        board.history = []
+        return board
+
+    @property
+    def player(self):
+        """
+
+        :return: the player to move
+        """
+        return PLAYERS[self.side]
+
+    @property
+    def opponent(self):
+        """
+
+        :return: the player that played the last move
+        """
+        return PLAYERS[self.side ^ 1]
+
+    def forced_box(self):
+        """
+
+        :return: the box the player to move must play in or 9 if the player can play anywhere
+        """
+        if self.last_move >= 0 and not self.closed() >> (self.last_move % 9) & 1:
+            return self.last_move % 9
+        return 9
+
+    def key(self):
+        """
+
+        :return: zobrist key of the pieces, the player to move and the forced box
+        """
+        return self.hash ^ FORCED_KEYS[self.forced_box()]
+
+    def filled(self):
+        """
+
+        :return: number of pieces on the board
+        """
+        return (self.pieces[0] | self.pieces[1]).bit_count()
+
+    def box_masks(self, b):
+        """
+
+        :param b: box number
+        :return: the 9 bit masks of X and O in the box
+        """
+        shift = b * 9
+        return (self.pieces[0] >> shift) & FULL_BOX, (self.pieces[1] >> shift) & FULL_BOX
+
+    def update_macro(self):
+        """
+        recompute the won and drawn boxes from the pieces
+        :return: nothing
+        """
+        macro = [0, 0]
+        drawn = 0
+        for b in range(9):
+            x, o = self.box_masks(b)
+            status = STATUS[x | (o << 9)]
+            if status == DRAW:
+                drawn |= 1 << b
+            elif status != OPEN:
+                macro[status - 1] |= 1 << b
+        self.macro = macro
+        self.drawn = drawn
+        self.result = STATUS_CHARS[macro_status(macro[0], macro[1], drawn)]
+
+    def closed(self):
+        """
+
+        :return: 9 bit mask of the boxes that can't be played anymore
+        """
+        return self.macro[0] | self.macro[1] | self.drawn
+
+    def status(self):
+        """
+
+        :return: the winner if there is one or D if draw or . if nothing yet
+        """
+        return self.result
+
+    def moves_to_win(self, side):
+        """
+        a lower bound of the moves the side needs to win, every open box of a macro line needs the
+        missing pieces of its best line that the opponent did not block
+        :param side: 0 for X, 1 for O
+        :return: least number of moves of the side to win the game, 81 if it can't win anymore
+        """
+        own, other = self.pieces[side], self.pieces[side ^ 1]
+        won, lost = self.macro[side], self.macro[side ^ 1] | self.drawn
+        need = []
+        for b in range(9):
+            if won >> b & 1:
+                need.append(0)
+                continue
+            shift = b * 9
+            x, o = (own >> shift) & FULL_BOX, (other >> shift) & FULL_BOX
+            lines = [3 - (x & line).bit_count() for line in LINE_MASKS if not o & line]
+            need.append(min(lines) if lines and not lost >> b & 1 else 81)
+        return min(81, min(need[i] + need[j] + need[k] for (i, j, k) in LINES))
+
+    def box_won(self):
+        """
+
+        :return: the status of every small box as a list like ultiTic.update_box_won
+        """
+        return [self.box_status(b) for b in range(9)]
+
+    def box_status(self, b):
+        """
+
+        :param b: box number
+        :return: X or O if the box was won, D if drawn or . if still open
+        """
+        if self.macro[0] >> b & 1:
+            return "X"
+        if self.macro[1] >> b & 1:
+            return "O"
+        if self.drawn >> b & 1:
+            return "D"
+        return "."
+
+    def possible_moves(self):
+        """
+
+        :return: list of legal moves for the player to move
+        """
+        return move_list(self.pieces[0], self.pieces[1], self.closed(), self.last_move)
+
+    def legal_mask(self):
+        """
+
+        :return: 81 bit mask of the legal moves for the player to move
+        """
+        return legal_mask(self.pieces[0], self.pieces[1], self.closed(), self.last_move)
+
+    def make(self, move):
+        """
+
+        :param move: move to be played by the player to move
+        :return: nothing
+        """
+        self.history.append((move, self.last_move, self.macro[self.side], self.drawn, self.result))
+        side = self.side
+        self.pieces[side] |= 1 << move
+        self.hash ^= PIECE_KEYS[side][move] ^ SIDE_KEY
+        self.last_move = move
+        self.side ^= 1
+        # only the box the move landed in can change its status
+        b = move // 9
+        shift = b * 9
+        status = STATUS[((self.pieces[0] >> shift) & FULL_BOX) | (((self.pieces[1] >> shift) & FULL_BOX) << 9)]
+        if status == OPEN:
+            return
+        if status == DRAW:
+            self.drawn |= 1 << b
+        else:
+            self.macro[side] |= 1 << b
+            if WIN[self.macro[side]]:
+                self.result = PLAYERS[side]
+        if self.result == "." and self.closed() == FULL_BOX:
+            self.result = "D"
+
+    def unmake(self):
+        """
+        take back the last move played
+        :return: nothing
+        """
+        move, self.last_move, macro, self.drawn, self.result = self.history.pop()
+        self.side ^= 1
+        self.pieces[self.side] &= ~(1 << move)
+        self.hash ^= PIECE_KEYS[self.side][move] ^ SIDE_KEY
+        self.macro[self.side] = macro
+
+    def to_string(self):
+        """
+
+        :return: the state as an 81 characters string
+        """
+        return "".join(self[i] for i in range(81))
+
+    def __len__(self):
+        return 81
+
+    def __getitem__(self, i):
+        """
+
+        :param i: index or slice of the string board
+        :return: the pieces at the index like the string state
+        """
+        if isinstance(i, slice):
+            start, stop, step = i.indices(81)
+            if step == 1 and stop - start == 9 and start % 9 == 0:
+                return box_string(*self.box_masks(start // 9))
+            return "".join(self[j] for j in range(*i.indices(81)))
+        i %= 81
+        if self.pieces[0] >> i & 1:
+            return "X"
+        if self.pieces[1] >> i & 1:
+            return "O"
+        return "."
@@ -0,0 +1,236 @@
+# =============================================================================
+# Opening book of the first moves of the game.
+#
+# The book is built offline by searching every position of the first plies
+# and is saved as a binary file:
+#   header  magic, version, flags, plies, number of records
+#   records (key, move) sorted by key, 8 bytes of key and 1 byte of move
+# The key is the zobrist key of the position.  With the symmetric flag only
+# the canonical form of every position is kept, its key is the zobrist key
+# of the canonical position and the move is a move of the canonical game.
+# The reader maps the file in memory and searches the sorted records, so
+# opening a book does not read it and a lookup only touches a few pages.
+# A book file is mapped once per process and shared by all the games.
+# The book file is given by the UTTT_OPENING_BOOK environment variable.
+# =============================================================================
+import mmap
+import os
+import struct
+import sys
+from time import time
+
+from bitboard import BitBoard
+from symmetry import canonical_key, inverse_move, transform_move
+from transposition import FORCED_KEYS, PIECE_KEYS, SIDE_KEY
+
+MAGIC = b"UTTTBOOK"
+VERSION = 1
+SYMMETRIC = 1
+HEADER = struct.Struct("<8sBBHI")
+RECORD = struct.Struct("<QB")
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening.book")
+
+# books opened by load_book by their absolute path
+open_books = dict()
+
+
+def zobrist(x, o, forced, side):
+    """
+
+    :param x: 81 bit mask of X
+    :param o: 81 bit mask of O
+    :param forced: box the player must play in, 9 if anywhere
+    :param side: 0 if X is to move, 1 if O is to move
+    :return: zobrist key of the position, the same as BitBoard.key
+    """
+    key = FORCED_KEYS[forced] ^ (SIDE_KEY if side else 0)
+    for keys, mask in zip(PIECE_KEYS, (x, o)):
+        while mask:
+            bit = mask & -mask
+            key ^= keys[bit.bit_length() - 1]
+            mask ^= bit
+    return key
+
+
+def book_key(board, symmetric):
+    """
+
+    :param board: bit board
+    :param symmetric: True to key the canonical form of the position
+    :return: (key, t) the key of the position in the book and the transform to its moves, 0 if not symmetric
+    """
+    if not symmetric:
+        return board.key(), 0
+    (x, o, forced, side), t = canonical_key(board)
+    return zobrist(x, o, forced, side), t
+
+
+def book_positions(plies, symmetric=True):
+    """
+    the positions with less than plies pieces that can be reached from the empty board
+    :param plies: number of moves the book covers
+    :param symmetric: True to keep one position of the symmetric ones
+    :return: dict of the book key to a board of the position
+    """
+    positions = dict()
+    layer = [BitBoard()]
+    for _ in range(plies):
+        following = []
+        for board in layer:
+            key = book_key(board, symmetric)[0]
+            if key in positions or board.status() != ".":
+                continue
+            positions[key] = board
+            for move in board.possible_moves():
+                child = board.copy()
+                child.make(move)
+                child.history = []
+                following.append(child)
+        layer = following
+    return positions
+
+
+def build_book(path, search, plies=2, symmetric=True, verbose=False):
+    """
+    search every position of the first plies and save the best moves
+    :param path: file to save the book to
+    :param search: function (state, last_move, player) -> best move
+    :param plies: number of moves the book covers
+    :param symmetric: True to keep one position of the symmetric ones
+    :param verbose: True to print the progress
+    :return: number of positions in the book
+    """
+    records = []
+    positions = book_positions(plies, symmetric)
+    for n, (key, board) in enumerate(positions.items()):
+        start = time()
+        move = search(board.to_string(), board.last_move, board.player)
+        t = book_key(board, symmetric)[1]
+        records.append((key, transform_move(move, t)))
+        if verbose:
+            print("position %d/%d move %d %.2fs" % (n + 1, len(positions), move, time() - start))
+    records.sort()
+    # a mapped book must not see its file truncated under it
+    close_book(path)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, SYMMETRIC if symmetric else 0, plies, len(records)))
+        for key, move in records:
+            f.write(RECORD.pack(key, move))
+    return len(records)
+
+
+class OpeningBook:
+    def __init__(self, path):
+        """
+
+        :param path: book file saved by build_book
+        """
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, self.plies, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError("%s is not an opening book of version %d" % (path, VERSION))
+        if len(self.data) != HEADER.size + self.count * RECORD.size:
+            self.data.close()
+            raise ValueError("%s is truncated" % path)
+        self.symmetric = bool(flags & SYMMETRIC)
+
+    def __len__(self):
+        """
+
+        :return: number of positions in the book
+        """
+        return self.count
+
+    def find(self, key):
+        """
+
+        :param key: book key of a position
+        :return: the move stored for the key, None if the key is not in the book
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record, move = RECORD.unpack_from(self.data, HEADER.size + middle * RECORD.size)
+            if record == key:
+                return move
+            if record < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, board):
+        """
+
+        :param board: bit board of the position
+        :return: the book move of the position, None if the position is not in the book
+        """
+        if board.filled() >= self.plies or board.status() != ".":
+            return None
+        key, t = book_key(board, self.symmetric)
+        move = self.find(key)
+        if move is None:
+            return None
+        move = inverse_move(move, t)
+        # a key collision could give a move that is not legal here
+        return move if board.legal_mask() >> move & 1 else None
+
+    def close(self):
+        """
+
+        :return: nothing
+        """
+        self.data.close()
+
+
+def load_book(path=None):
+    """
+
+    :param path: book file, UTTT_OPENING_BOOK or the book next to this module if None
+    :return: the opening book shared by the callers of the same file, None if there is no book file
+    """
+    path = path or os.environ.get("UTTT_OPENING_BOOK") or DEFAULT_BOOK
+    if not os.path.exists(path):
+        return None
+    key = os.path.abspath(path)
+    if key not in open_books:
+        open_books[key] = OpeningBook(path)
+    return open_books[key]
+
+
+def close_book(path):
+    """
+
+    :param path: book file
+    :return: nothing, the book of the file opened by load_book is closed and the next load_book opens it again
+    """
+    book = open_books.pop(os.path.abspath(path), None)
+    if book is not None:
+        book.close()
+
+
+if __name__ == "__main__":
+    """
+    build a book: python book.py [path] [plies] [depth] [heuristic] [time limit]
+    """
+    from heuristics import heuristics
+    from uttt2 import ultiTic
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BOOK
+    plies = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    heuristic = sys.argv[4] if len(sys.argv) > 4 else "1"
+    time_limit = float(sys.argv[5]) if len(sys.argv) > 5 else 0
+    game = ultiTic(None, None, "." * 81)
+    game.book = None
+    eval_func = heuristics(depth).get_heur(heuristic)
+
+    def search(state, last_move, player):
+        if time_limit:
+            return game.iterative_deepening(state, last_move, player, depth, eval_func, time_limit, game.min_turn)
+        return game.minimax(state, last_move, player, depth, eval_func)
+
+    count = build_book(path, search, plies, verbose=True)
+    print("saved %d positions to %s" % (count, path))
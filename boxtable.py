@@ -0,0 +1,144 @@
+# =============================================================================
+# Lookup tables for the status of a 3x3 box.
+#
+# A box is encoded by the 9 bit masks of its X cells and O cells, the index to
+# the status table is x | (o << 9).  The same tables are used for the small
+# boxes and for the macro board, where the drawn boxes fill the board without
+# belonging to any player.
+# The tables are built once at import, they can be saved to and loaded from a
+# file given by the UTTT_BOX_TABLE environment variable.  The file starts with
+# a magic header, a file that is not a table file is never read nor replaced.
+# =============================================================================
+import os
+
+FULL_BOX = 0x1FF
+
+LINES = [(0, 4, 8), (2, 4, 6)]
+LINES += [(i, i + 3, i + 6) for i in range(3)]
+LINES += [(3 * i, 3 * i + 1, 3 * i + 2) for i in range(3)]
+LINE_MASKS = [(1 << x) | (1 << y) | (1 << z) for (x, y, z) in LINES]
+
+OPEN, X_WON, O_WON, DRAW = 0, 1, 2, 3
+STATUS_CHARS = ".XOD"
+
+TABLE_MAGIC = b"UTTTBOX1"
+TABLE_SIZE = len(TABLE_MAGIC) + 512 + (1 << 18)
+
+X_BITS = str.maketrans("XOD.", "1000")
+O_BITS = str.maketrans("XOD.", "0100")
+D_BITS = str.maketrans("XOD.", "0010")
+
+
+def build_tables():
+    """
+
+    :return: the win table indexed by a player mask and the status table indexed by x | (o << 9)
+    """
+    win = bytearray(512)
+    first_line = [-1] * 512
+    for mask in range(512):
+        for i, line in enumerate(LINE_MASKS):
+            if mask & line == line:
+                win[mask] = 1
+                first_line[mask] = i
+                break
+    status = bytearray(1 << 18)
+    for x in range(512):
+        free = FULL_BOX ^ x
+        o = free
+        while True:
+            if win[x] and (not win[o] or first_line[x] <= first_line[o]):
+                status[x | (o << 9)] = X_WON
+            elif win[o]:
+                status[x | (o << 9)] = O_WON
+            elif x | o == FULL_BOX:
+                status[x | (o << 9)] = DRAW
+            if o == 0:
+                break
+            o = (o - 1) & free
+    return win, status
+
+
+def save_tables(path, win, status):
+    """
+    the tables are written to a temporary file that then replaces the path
+    :param path: file to save the tables to
+    :param win: win table
+    :param status: status table
+    :return: nothing
+    """
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp, "wb") as f:
+            f.write(TABLE_MAGIC)
+            f.write(win)
+            f.write(status)
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def load_tables(path=None):
+    """
+
+    :param path: file of saved tables, built and saved there if missing
+    :return: the win table and the status table
+    """
+    if path and os.path.exists(path):
+        if os.path.getsize(path) == TABLE_SIZE:
+            with open(path, "rb") as f:
+                data = f.read()
+            if data.startswith(TABLE_MAGIC):
+                start = len(TABLE_MAGIC)
+                return bytearray(data[start:start + 512]), bytearray(data[start + 512:])
+        # not a table file, it is left as it is and the tables are built
+        return build_tables()
+    win, status = build_tables()
+    if path:
+        try:
+            save_tables(path, win, status)
+        except OSError:
+            # the tables in memory are used without a file
+            pass
+    return win, status
+
+
+WIN, STATUS = load_tables(os.environ.get("UTTT_BOX_TABLE"))
+
+
+def box_status(x, o):
+    """
+
+    :param x: 9 bit mask of X in the box
+    :param o: 9 bit mask of O in the box
+    :return: OPEN, X_WON, O_WON or DRAW
+    """
+    return STATUS[x | (o << 9)]
+
+
+def macro_status(x, o, drawn):
+    """
+
+    :param x: 9 bit mask of the boxes won by X
+    :param o: 9 bit mask of the boxes won by O
+    :param drawn: 9 bit mask of the drawn boxes
+    :return: OPEN, X_WON, O_WON or DRAW
+    """
+    status = STATUS[x | (o << 9)]
+    if status == OPEN and x | o | drawn == FULL_BOX:
+        return DRAW
+    return status
+
+
+def string_status(box_str):
+    """
+
+    :param box_str: 9 characters of a small box or of the macro board
+    :return: the winner if there is one or D if draw or . if nothing yet
+    """
+    if not isinstance(box_str, str):
+        box_str = "".join(box_str)
+    box_str = box_str[::-1]
+    return STATUS_CHARS[macro_status(int(box_str.translate(X_BITS), 2), int(box_str.translate(O_BITS), 2),
+                                     int(box_str.translate(D_BITS), 2))]
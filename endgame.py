@@ -0,0 +1,171 @@
+# =============================================================================
+# Exact solver of the late positions.
+#
+# Once few empty cells can still be played, the game is searched to the end
+# with alpha-beta on the win/draw/loss values only, 1 win, 0 draw and -1 loss
+# for the player to move.  With a window this narrow most of the moves are
+# cut after the first one, and the solved positions are kept in a
+# transposition table that lives across the moves of a game, the depth of an
+# entry is the number of empty cells under it.  A search that goes over the
+# node limit or its time limit is given up and the caller searches as usual.
+# =============================================================================
+from time import time
+
+from bitboard import BitBoard
+from boxtable import FULL_BOX, WIN
+from movegen import OPEN_MASKS
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+ALL_CELLS = (1 << 81) - 1
+WIN_VALUE, DRAW_VALUE, LOSS_VALUE = 1, 0, -1
+
+
+class SolverLimit(Exception):
+    """
+    raised when a solve goes over its node limit or its time limit
+    """
+    pass
+
+
+class EndgameSolver:
+    def __init__(self, max_empty=16, node_limit=100000, table_size=1 << 16):
+        """
+
+        :param max_empty: most empty cells in the open boxes for the solver to take over
+        :param node_limit: most nodes of one solve, 0 for no limit
+        :param table_size: number of buckets of the solved positions table
+        """
+        self.max_empty = max_empty
+        self.node_limit = node_limit
+        self.table = TranspositionTable(table_size)
+        self.nodes = 0
+        self.deadline = None
+
+    def __getstate__(self):
+        """
+
+        :return: the attributes to pickle, the solved positions are not sent to other processes
+        """
+        attributes = self.__dict__.copy()
+        attributes["table"] = TranspositionTable(self.table.size)
+        return attributes
+
+    def empty_cells(self, board):
+        """
+
+        :param board: bit board
+        :return: number of empty cells in the open boxes, every move fills one of them
+        """
+        return (ALL_CELLS & ~(board.pieces[0] | board.pieces[1]) & OPEN_MASKS[board.closed()]).bit_count()
+
+    def applies(self, board):
+        """
+
+        :param board: bit board
+        :return: True if the position is late enough to be solved
+        """
+        return board.status() == "." and self.empty_cells(board) <= self.max_empty
+
+    def solve(self, board, time_limit=0):
+        """
+
+        :param board: bit board of a game that is not decided
+        :param time_limit: seconds the solve may take, 0 for no limit
+        :return: (value, move) of the position for the player to move, None if the node or time limit was reached
+        """
+        self.nodes = 0
+        self.deadline = time() + time_limit if time_limit else None
+        try:
+            value = self.negamax(board, LOSS_VALUE, WIN_VALUE)
+        except SolverLimit:
+            return None
+        finally:
+            self.deadline = None
+        return value, self.table.probe(board.key())[4]
+
+    def solve_state(self, state, last_move, player, time_limit=0):
+        """
+
+        :param state: current state
+        :param last_move: last move played
+        :param player: player to move
+        :param time_limit: seconds the solve may take, 0 for no limit
+        :return: (value, move) of the position, None if it is not late enough or could not be solved
+        """
+        board = BitBoard(state, last_move, player)
+        if not self.applies(board):
+            return None
+        return self.solve(board, time_limit)
+
+    def order(self, board, moves, best):
+        """
+
+        :param board: bit board
+        :param moves: legal moves
+        :param best: move stored for the position, None if none
+        :return: the moves with the stored move first and the moves that win a box next
+        """
+        own = board.pieces[board.side]
+        winning, others = [], []
+        for move in moves:
+            if move == best:
+                continue
+            shift = move - move % 9
+            if WIN[((own >> shift) & FULL_BOX) | 1 << (move % 9)]:
+                winning.append(move)
+            else:
+                others.append(move)
+        return ([best] if best is not None else []) + winning + others
+
+    def negamax(self, board, alpha, beta):
+        """
+
+        :param board: bit board, the moves are made and taken back on it
+        :param alpha: lowest value the player to move is sure of
+        :param beta: highest value the opponent lets the player to move have
+        :return: the value of the position for the player to move
+        """
+        self.nodes += 1
+        if self.node_limit and self.nodes > self.node_limit:
+            raise SolverLimit()
+        if self.deadline is not None and self.nodes % 1024 == 0 and time() > self.deadline:
+            raise SolverLimit()
+        result = board.status()
+        if result != ".":
+            # the last move decided the game
+            return DRAW_VALUE if result == "D" else LOSS_VALUE
+        key = board.key()
+        entry = self.table.probe(key)
+        best_move = None
+        if entry is not None:
+            _, _, flag, value, best_move = entry
+            if flag == EXACT:
+                return value
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+        original_alpha = alpha
+        best = None
+        for move in self.order(board, board.possible_moves(), best_move):
+            board.make(move)
+            try:
+                value = -self.negamax(board, -beta, -alpha)
+            finally:
+                board.unmake()
+            if best is None or value > best:
+                best, best_move = value, move
+            if value > alpha:
+                alpha = value
+                if alpha >= beta:
+                    break
+        if best <= original_alpha:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(key, self.empty_cells(board), flag, best, best_move)
+        return best
@@ -3,12 +3,66 @@ from collections import Counter
 
 import math
 
+from bitboard import BitBoard
+from boxtable import DRAW, FULL_BOX, OPEN, STATUS, X_WON
+
+# scores of the boxes already evaluated by every heuristic, for each player the box string to its score,
+# a box has at most 4^9 contents so the caches stay small, the incremental scores also keep the
+# 9 bit masks of the boxes as keys, x | o << 9 for a small box and x | o << 9 | drawn << 18 for the macro board
+SMALL_BOX_CACHE = {"X": {}, "O": {}}
+SMALL_MATRIX_CACHE = {"X": {}, "O": {}}
+BLOCKING_CACHE = {"X": {}, "O": {}}
+
+# a box scores between -160 and 800 by evaluate_small_box (found over every box string) and between
+# -(76^2 + 4 * 76 + 4) and 76^2 + 4 * 76 + 4 by the weights of evaluate_small_matrix, the macro board
+# counts 200 times and the 9 boxes once
+H1_BOUNDS = (-160 * 209, 800 * 209)
+H2_BOUNDS = (-6084 * 209, 6084 * 209)
+# the 8 lines of a box add up to at least -50000 and at most 10000 each, the next box is only added
+# to a score of 2500 or more
+BLOCKING_BOUNDS = (-400000, 160000)
+
+
+def score_bounds(low, high):
+    """
+    declare the lowest and highest score a heuristic can give, the expectimax search prunes its chance
+    nodes with them
+    :param low: lowest score
+    :param high: highest score
+    :return: decorator setting the bounds attribute of the heuristic
+    """
+    def declare(evaluate):
+        evaluate.bounds = (low, high)
+        return evaluate
+    return declare
+
 
 class heuristics:
-    def __init__(self,depth):
+    def __init__(self,depth,cache=True,incremental=True,debug=False):
+        """
 
+        :param depth: search depth
+        :param cache: True to look the box scores up in the caches instead of evaluating every box
+        :param incremental: True to score the bit boards of a search from the scores of the positions before
+                            them on the search path, h1 and h2 only, needs the caches
+        :param debug: True to check every incremental score against the full score
+        """
         self.depth=depth
+        self.cache=cache
+        self.incremental=incremental and cache
+        self.debug=debug
+        self.stacks={}
 
+    def __getstate__(self):
+        """
+
+        :return: the settings, the search stacks are not sent to other processes
+        """
+        state = dict(self.__dict__)
+        state["stacks"] = {}
+        return state
+
+    @score_bounds(*H1_BOUNDS)
     def h1(self,game,state,last_move,player):
         """
 
@@ -18,14 +72,162 @@ class heuristics:
         :return: score for this state
         """
 
+        if self.incremental and isinstance(state, BitBoard):
+            return self.incremental_score(game, state, player, SMALL_BOX_CACHE[player], self.evaluate_small_box)
+        if self.cache:
+            return self.cached_score(game, state, player, SMALL_BOX_CACHE[player], self.evaluate_small_box)
         score = 0
-        score += self.evaluate_small_box(game,game.box_won, player) * 200
+        score += self.evaluate_small_box(game,game.macro_of(state), player) * 200
         for b in range(9):
             idxs = game.indices_of_box(b)
             box_str = state[idxs[0]: idxs[-1] + 1]
             score += self.evaluate_small_box(game,box_str, player)
         return score
 
+    def cached_score(self, game, state, player, cache, evaluate):
+        """
+        the macro board score times 200 plus the scores of the 9 boxes, every box looked up in the cache
+        :param game: game object
+        :param state: current game state/board
+        :param player: current player
+        :param cache: box string to score for the player
+        :param evaluate: function scoring a box if it is not in the cache
+        :return: score for this state
+        """
+        macro = "".join(game.macro_of(state))
+        score = cache.get(macro)
+        if score is None:
+            score = cache[macro] = evaluate(game, macro, player)
+        score *= 200
+        for b in range(9):
+            box_str = state[b * 9: b * 9 + 9]
+            box_score = cache.get(box_str)
+            if box_score is None:
+                box_score = cache[box_str] = evaluate(game, box_str, player)
+            score += box_score
+        return score
+
+    def incremental_score(self, game, board, player, cache, evaluate):
+        """
+        the same score as cached_score from a stack with an entry for every position of the board's history,
+        the entries of the moves still on the search path are kept and only the box of every new move and the
+        macro board when a box was closed are scored
+        :param game: game object
+        :param board: bit board of the search
+        :param player: current player
+        :param cache: box string to score for the player
+        :param evaluate: function scoring a box if it is not in the cache
+        :return: score for this state
+        """
+        history = board.history
+        ply = len(history)
+        stack = self.stacks.get(id(cache))
+        if stack is None or stack[0] is not board:
+            stack = self.stacks[id(cache)] = (board, [self.root_entry(game, board, player, cache, evaluate)])
+        entries = stack[1]
+        i = 1
+        last = min(len(entries), ply + 1)
+        while i < last and entries[i][0] == history[i - 1][0]:
+            i += 1
+        del entries[i:]
+        # the side of the first move of the history
+        side = board.side ^ (ply & 1)
+        for i in range(i, ply + 1):
+            entries.append(self.push_entry(game, entries[-1], history[i - 1][0], side ^ ((i - 1) & 1), player,
+                                           cache, evaluate))
+        score = entries[-1][-1]
+        if self.debug:
+            full = self.cached_score(game, board, player, cache, evaluate)
+            if score != full:
+                raise ValueError("incremental score %s is not the full score %s" % (score, full))
+        return score
+
+    def root_entry(self, game, board, player, cache, evaluate):
+        """
+
+        :param game: game object
+        :param board: bit board of the search
+        :param player: current player
+        :param cache: box string to score for the player
+        :param evaluate: function scoring a box if it is not in the cache
+        :return: stack entry of the position before the moves of the board's history
+        """
+        removed = 0
+        for entry in board.history:
+            removed |= 1 << entry[0]
+        x, o = board.pieces[0] & ~removed, board.pieces[1] & ~removed
+        boxes = []
+        macro_x = macro_o = drawn = 0
+        for b in range(9):
+            box_x, box_o = (x >> (b * 9)) & FULL_BOX, (o >> (b * 9)) & FULL_BOX
+            boxes.append(self.mask_score(game, box_x | box_o << 9, player, cache, evaluate))
+            status = STATUS[box_x | box_o << 9]
+            if status == DRAW:
+                drawn |= 1 << b
+            elif status != OPEN:
+                if status == X_WON:
+                    macro_x |= 1 << b
+                else:
+                    macro_o |= 1 << b
+        macro_score = self.mask_score(game, macro_x | macro_o << 9 | drawn << 18, player, cache, evaluate)
+        return None, x, o, macro_x, macro_o, drawn, boxes, macro_score, macro_score * 200 + sum(boxes)
+
+    def push_entry(self, game, entry, move, side, player, cache, evaluate):
+        """
+
+        :param game: game object
+        :param entry: stack entry of the position before the move
+        :param move: move played
+        :param side: 0 if X played the move, 1 if O played it
+        :param player: current player
+        :param cache: box string to score for the player
+        :param evaluate: function scoring a box if it is not in the cache
+        :return: stack entry of the position after the move
+        """
+        last, x, o, macro_x, macro_o, drawn, boxes, macro_score, score = entry
+        if side:
+            o |= 1 << move
+        else:
+            x |= 1 << move
+        b = move // 9
+        key = ((x >> (b * 9)) & FULL_BOX) | ((o >> (b * 9)) & FULL_BOX) << 9
+        box_score = self.mask_score(game, key, player, cache, evaluate)
+        score += box_score - boxes[b]
+        boxes = list(boxes)
+        boxes[b] = box_score
+        status = STATUS[key]
+        if status != OPEN:
+            if status == DRAW:
+                drawn |= 1 << b
+            elif side:
+                macro_o |= 1 << b
+            else:
+                macro_x |= 1 << b
+            new_macro = self.mask_score(game, macro_x | macro_o << 9 | drawn << 18, player, cache, evaluate)
+            score += (new_macro - macro_score) * 200
+            macro_score = new_macro
+        return move, x, o, macro_x, macro_o, drawn, boxes, macro_score, score
+
+    def mask_score(self, game, key, player, cache, evaluate):
+        """
+
+        :param game: game object
+        :param key: x | o << 9 | drawn << 18 masks of the box
+        :param player: current player
+        :param cache: box string to score for the player
+        :param evaluate: function scoring a box if it is not in the cache
+        :return: score of the box, looked up in the cache
+        """
+        score = cache.get(key)
+        if score is None:
+            box_str = "".join("X" if key >> i & 1 else "O" if key >> (i + 9) & 1 else "D" if key >> (i + 18) & 1
+                              else "." for i in range(9))
+            score = cache.get(box_str)
+            if score is None:
+                score = cache[box_str] = evaluate(game, box_str, player)
+            cache[key] = score
+        return score
+
     def evaluate_small_box(self, game,box_str, player):
         """
         :param box_str: box to evaluate
@@ -60,6 +262,7 @@ class heuristics:
 
         return score
 
+    @score_bounds(*H2_BOUNDS)
     def evaluate2(self, game,state, last_move, player):
         """
 
@@ -69,8 +272,13 @@ class heuristics:
         :return: score for this state
         """
 
+        if self.incremental and isinstance(state, BitBoard):
+            return self.incremental_score(game, state, player, SMALL_MATRIX_CACHE[player],
+                                          self.evaluate_small_matrix)
+        if self.cache:
+            return self.cached_score(game, state, player, SMALL_MATRIX_CACHE[player], self.evaluate_small_matrix)
         score = 0
-        score += self.evaluate_small_matrix(game,game.box_won, player) * 200
+        score += self.evaluate_small_matrix(game,game.macro_of(state), player) * 200
         for b in range(9):
             idxs = game.indices_of_box(b)
             box_str = state[idxs[0]: idxs[-1] + 1]
@@ -90,7 +298,7 @@ class heuristics:
         corner_indecies = [0, 2, 6, 8]
         side_indecies = [1, 3, 5, 7]
 
-        for idx in box_str:
+        for idx in range(9):
             if idx == center_index:
                 if box_str[idx] == player:
                     score += (76 ** 2)
@@ -108,6 +316,7 @@ class heuristics:
                     score -= 1
         return score
 
+    @score_bounds(*BLOCKING_BOUNDS)
     def evaluateBlocking(self, game, state, lastMove, player):
         """
 
@@ -124,8 +333,7 @@ class heuristics:
             opponent = 'O'
         possibleMoves = game.possible_moves(state, lastMove)
         if(possibleMoves == []):
-            temp = game.update_box_won(state)
-            game_won = game.check_small_box(temp)
+            game_won = game.game_status(state)
             if(game_won == player):
                 return 100000
             elif(game_won == opponent):
@@ -134,10 +342,34 @@ class heuristics:
                 return 0
         box1 = int(lastMove / 9)
         box2 = int(possibleMoves[0] / 9)
+        if self.cache:
+            # the next state score is the current state score of the next box added to a good enough score
+            check1 = self.blockingBoxScore(box1, game, player, opponent, state)
+            if check1 >= 2500:
+                return self.blockingBoxScore(box2, game, player, opponent, state) + check1
+            return check1
         check1 = self.evaluateByCurrentStateBox(box1, game, player, opponent, state)
         check3 = self.evaluateByNextStateBox(box2, game, player, opponent, state, check1)
         return check3
 
+    def blockingBoxScore(self, box, game, player, opponent, state):
+        """
+
+        :param box: The current states box number(outer)
+        :param game: Game object
+        :param player: Current player
+        :param opponent: Opponent
+        :param state: Current state
+        :return: evaluateByCurrentStateBox of the box, looked up in the cache
+        """
+        box_str = state[box * 9: box * 9 + 9]
+        cache = BLOCKING_CACHE[player]
+        score = cache.get(box_str)
+        if score is None:
+            # the box is scored alone so it is the same in every place of the board
+            score = cache[box_str] = self.evaluateByCurrentStateBox(0, game, player, opponent, box_str)
+        return score
+
     def evaluateByCurrentStateBox(self, box, game, player, opponent, state):
         """
 
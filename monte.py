@@ -1,9 +1,108 @@
-from copy import deepcopy
 import math
+import random
+from time import perf_counter
+
+from arena import ROOT, NodeArena
+from batch import BatchPlayout
+from bitboard import BitBoard
+from heuristics import heuristics
+from playout import Playout
+
+# score of every heuristic where a truncated rollout gives X a win probability of 1 / (1 + e^-1)
+SCALES = {"1": 500, "2": 100000, "3": 10000}
+# the root row and its 81 children always stay in the tree, with a smaller budget half of it can't hold them
+# and the next expansion of 81 rows would go over the budget again
+MIN_NODE_BUDGET = 2 * (1 + 81)
+
+
+def playout(board, last_move, player, engine=None):
+    """
+    play a full game with random moves
+    :param board: state to play from
+    :param last_move: last move played
+    :param player: player to move
+    :param engine: playout engine to play on, a new one if None
+    :return: which player won
+    """
+    engine = engine or Playout()
+    engine.load_string(board, last_move, player)
+    return engine.run()
+
+
+def simulate_batch(board, last_move, player, count, seed):
+    """
+    play random games in a worker process
+    :param board: state to play from
+    :param last_move: last move played
+    :param player: player to move
+    :param count: number of games
+    :param seed: seed of the random moves of this batch
+    :return: list of the winners
+    """
+    random.seed(seed)
+    engine = Playout()
+    return [playout(board, last_move, player, engine) for _ in range(count)]
+
+
+def search_tree(board, game, last_move, player, iterations, exploration_weight, seed, time_limit=None,
+                max_nodes=None, rave=None, policy=None, node_budget=None):
+    """
+    build an independent tree in a worker process
+    :param board: current game state
+    :param game: UTTT object
+    :param last_move: last move by the opponent
+    :param player: current player
+    :param iterations: number of iterations of this tree
+    :param exploration_weight: number used in calculating the node score
+    :param seed: seed of the random moves of this tree
+    :param time_limit: seconds the tree is searched in anytime mode
+    :param max_nodes: most nodes of this tree in anytime mode
+    :param rave: equivalence parameter of the RAVE schedule, None for plain UCT
+    :param policy: rollout policy, random rollouts if None
+    :param node_budget: most rows of the tree, no limit if None
+    :return: the wins and visits of every root move
+    """
+    random.seed(seed)
+    tree = MCTS(board, game, last_move, player, iterations, exploration_weight, time_limit=time_limit,
+                max_nodes=max_nodes, rave=rave, policy=policy, node_budget=node_budget)
+    tree.solve()
+    return tree.root_stats()
+
+
+class RolloutPolicy:
+    def __init__(self, epsilon=1.0, plies=None, heuristic="1", scale=None):
+        """
+
+        :param epsilon: probability of a random move, with 1 - epsilon a move that wins or blocks a small box
+        :param plies: moves of a truncated rollout, the rollouts are played to the end if None
+        :param heuristic: heuristic scoring a truncated rollout, "1" h1, "2" evaluate2, "3" evaluateBlocking
+        :param scale: score where X wins with probability 1 / (1 + e^-1), the default of the heuristic if None
+        """
+        self.epsilon = epsilon
+        self.plies = plies
+        self.heuristic = heuristic
+        self.scale = scale or SCALES[heuristic]
+        self.eval = heuristics(0).get_heur(heuristic)
+
+    def run(self, engine, game, moves=None):
+        """
+        play a rollout on the playout engine
+        :param engine: playout engine loaded with the state to play from
+        :param game: game object for the heuristic
+        :param moves: list that gets the moves played, not recorded if None
+        :return: which player won or for a truncated rollout the expected result for X between -1 and 1
+        """
+        result = engine.run(moves, self.plies, self.epsilon)
+        if result != ".":
+            return result
+        board = BitBoard(engine.to_string(), engine.last_move, "XO"[engine.side])
+        return math.tanh(self.eval(game, board, board.last_move, "X") / (2 * self.scale))
 
 
 class MCTS:
-    def __init__(self, board, game, last_move, player, iterations=250, exploration_weight=0.2, parent=None):
+    def __init__(self, board, game, last_move, player, iterations=250, exploration_weight=0.2, parent=None,
+                 parallel=None, workers=1, batch=None, rollouts=1, time_limit=None, max_nodes=None,
+                 rave=None, policy=None, node_budget=None):
         """
 
         :param board: current game state
@@ -13,195 +112,387 @@ class MCTS:
         :param parent: usually None
         :param iterations: number of iteration and nodes expanded
         :param exploration_weight: number used in calculating the node score
+        :param parallel: None, "root" for independent trees merged at the end or "leaf" for parallel rollouts
+        :param workers: number of processes
+        :param batch: number of rollouts of every leaf in "leaf" mode, the number of processes if None
+        :param rollouts: number of rollouts of every leaf played together with numpy, 1 plays a single rollout
+        :param time_limit: seconds of search in anytime mode, the iterations are not used in this mode
+        :param max_nodes: most iterations in anytime mode, every iteration expands at most one node
+        :param rave: equivalence parameter of the RAVE schedule, about the visits where the all moves as first
+                     and the UCT values weigh the same, None for plain UCT
+        :param policy: rollout policy of the single rollouts, random rollouts if None
+        :param node_budget: most rows of the tree, the children not expanded yet included, when it is reached
+                            the subtrees with the least visits are removed until half of it is left, at least
+                            MIN_NODE_BUDGET
         """
-        self.children = dict()  # children of each self.node
-        self.node = Node(board, parent, last_move, game, exploration_weight)
-        self.node.update_children()
-        self.children[self.node] = self.node.get_children()
+        if node_budget is not None and node_budget < MIN_NODE_BUDGET:
+            raise ValueError("node budget %d is less than %d rows" % (node_budget, MIN_NODE_BUDGET))
+        self.arena = NodeArena(last_move, rave is not None)
+        self.node = Node(self.arena, ROOT)
         self.exploration_weight = exploration_weight
-        self.global_path = []
         self.board = board
+        self.root_board = BitBoard(board, last_move, player)
         self.iterations = iterations
         self.player = player
         self.last_move = last_move
         self.game = game
+        self.parallel = parallel if workers > 1 else None
+        self.workers = workers
+        self.batch = batch or workers
+        self.played = None
+        self.engine = Playout()
+        self.rollouts = rollouts
+        self.batch_engine = BatchPlayout(random.getrandbits(64)) if rollouts > 1 else None
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.anytime = time_limit is not None or max_nodes is not None
+        self.start = None
+        self.done = 0
+        # most visits a root child got in one iteration, one on the way down and one for every score
+        self.step = 2
+        self.rave = rave
+        self.policy = policy
+        self.node_budget = node_budget
 
     def solve(self):
         """
         this function connect everything it select then expand then simulate then back propagation and return best move
         :return: the best move to play
         """
-        new_state = self.node
-        if new_state.board=="."*81:
+        if self.board=="."*81:
+            self.played = 40
             return 1,40
-
-        for i in range(self.iterations):
-            succ = new_state
-            # selection: select the best node
-            while succ.children != []:
-                succ.update_visits()
-                succ = succ.get_succesor()
-            succ.update_visits()
+        if self.parallel == "root":
+            score, self.played = self.solve_root_parallel()
+            return score, self.played
+
+        arena, board = self.arena, self.root_board
+        self.start = perf_counter()
+        self.done = 0
+        self.step = 2
+        while self.searching():
+            self.done += 1
+            if self.node_budget is not None and len(arena) >= self.node_budget:
+                arena = self.arena = arena.evict(self.node_budget // 2)
+                self.node = Node(arena, ROOT)
+            succ = ROOT
+            path = [ROOT]
+            # selection: select the best node until a node that still has unexpanded moves
+            while arena.expanded[succ] and arena.fully_expanded(succ):
+                arena.visits[succ] += 1
+                succ = self.get_succesor(succ)
+                board.make(arena.move[succ])
+                path.append(succ)
+            arena.visits[succ] += 1
             # expansion : expand a new random move,state
-            succ = self.expand_node(succ)
+            succ = self.expand_node(succ, board)
+            if succ != path[-1]:
+                board.make(arena.move[succ])
+                path.append(succ)
 
             # simulate a game: play a game to check the results
-            score = self.simulate(succ)
+            rollout = [] if self.rave is not None else None
+            if self.parallel == "leaf":
+                scores = self.simulate_parallel(board)
+            elif self.rollouts > 1:
+                scores = self.simulate_rollouts(board)
+            else:
+                scores = [self.simulate(board, rollout)]
 
             # backpropagation : update the nodes visits and wins to the root
-            self.update_the_way(succ, score)
-
-        succ = sorted(new_state.children, key=lambda c: c.wins / c.visists)
-        return (succ[-1].score, succ[-1].move)
+            self.step = max(self.step, 1 + len(scores))
+            for score in scores:
+                self.update_the_way(path, score)
+                if self.rave is not None:
+                    self.update_amaf(path, rollout or [], score)
+            for j in range(len(path) - 1):
+                board.unmake()
+
+        if self.anytime:
+            # the move with the most visits, the early stop keeps it the best
+            best = max(reversed(arena.children(ROOT)), key=lambda c: arena.visits[c])
+        else:
+            best = max(reversed(arena.children(ROOT)), key=lambda c: arena.wins[c] / arena.visits[c])
+        self.played = arena.move[best]
+        return (arena.wins[best] / arena.visits[best], self.played)
 
-    def simulate(self, node):
+    def searching(self):
         """
-        simulate a full game with random moves
-        :param node: current game state node
-        :return: which player won
+
+        :return: True if the search should run another iteration
         """
-        to_sim = deepcopy(node)
-        box_won = to_sim.game.update_box_won(to_sim.board)
-        game_won = to_sim.game.check_small_box(box_won)
-        player = "X" if to_sim.board[to_sim.move] == "O" else "O"
-        while game_won == ".":
-            action = to_sim.game.random_move(to_sim.board, to_sim.move)
-            to_sim.board = to_sim.game.add_piece(to_sim.board, action, player)
-            player = to_sim.game.opponent(player)
-            box_won = to_sim.game.update_box_won(to_sim.board)
-            game_won = to_sim.game.check_small_box(box_won)
-        return game_won
+        if not self.anytime:
+            return self.done < self.iterations
+        remaining = self.max_nodes - self.done if self.max_nodes is not None else math.inf
+        if self.time_limit is not None:
+            now = perf_counter()
+            left = self.start + self.time_limit - now
+            if left <= 0:
+                return False
+            # no rate yet while the clock has not moved since the start
+            if self.done and now > self.start:
+                remaining = min(remaining, left * self.done / (now - self.start))
+        if remaining <= 0:
+            return False
+        # early stop: every iteration adds at most self.step visits to a root child already in the tree
+        if self.done % 16 == 0 and self.arena.fully_expanded(ROOT) and self.arena.expanded[ROOT] > 1:
+            visits = sorted(self.arena.visits[c] for c in self.arena.children(ROOT))
+            if visits[-1] - visits[-2] > self.step * remaining:
+                return False
+        return True
 
-    def update_the_way(self, ran, score_to_update):
+    def simulate(self, board, moves=None):
         """
-        this function updates the win/loses of every node
-        :param ran: leaf node
-        :param score_to_update: parameter to determine how to update
-        :return: nothing
+        simulate a game with the rollout policy, random moves to the end if there is none
+        :param board: bit board of the node
+        :param moves: list that gets the moves of the game, not recorded if None
+        :return: which player won or the expected result for X
         """
-        if self.player == score_to_update:
-            game_result = 1
-        elif score_to_update == "D":
-            game_result = 0
-        else:
-            game_result = -1
-        while ran.get_parent() is not None:
-            ran.update_wins(game_result)
-            ran.update_visits()
-            ran = ran.get_parent()
+        self.engine.load_board(board)
+        if self.policy is not None:
+            return self.policy.run(self.engine, self.game, moves)
+        return self.engine.run(moves)
 
-    def expand_node(self, succ):
+    def simulate_rollouts(self, board):
+        """
+        simulate many games from the node at once with the numpy playouts
+        :param board: bit board of the node
+        :return: list of which player won every game
         """
+        x_won, o_won, draws = self.batch_engine.counts(self.rollouts, board.to_string(), board.last_move,
+                                                       board.player)
+        return ["X"] * x_won + ["O"] * o_won + ["D"] * draws
 
-        :param succ: node to be expanded
-        :return: and expanded node which is the next state of current state
+    def simulate_parallel(self, board):
         """
-        player = "X" if succ.board[succ.move] == "O" else "O"
-        if not succ.game.possible_moves(succ.board, succ.move):
-            return succ
+        simulate a batch of games from the node in the process pool
+        :param board: bit board of the node
+        :return: list of which player won every game
+        """
+        state, player = board.to_string(), board.player
+        pool = self.game.process_pool(self.workers)[0]
+        sizes = [self.batch // self.workers + (i < self.batch % self.workers) for i in range(self.workers)]
+        futures = [pool.submit(simulate_batch, state, board.last_move, player, size, random.getrandbits(64))
+                   for size in sizes if size]
+        return [score for future in futures for score in future.result()]
+
+    def solve_root_parallel(self):
+        """
+        build independent trees in the process pool and merge the statistics of their root moves
+        :return: the best score and the best move to play
+        """
+        pool = self.game.process_pool(self.workers)[0]
+        iterations = -(-self.iterations // self.workers)
+        max_nodes = -(-self.max_nodes // self.workers) if self.max_nodes is not None else None
+        futures = [pool.submit(search_tree, self.board, self.game, self.last_move, self.player, iterations,
+                               self.exploration_weight, random.getrandbits(64), self.time_limit, max_nodes,
+                               self.rave, self.policy, self.node_budget)
+                   for _ in range(self.workers)]
+        stats = dict()
+        for future in futures:
+            for move, (wins, visits) in future.result().items():
+                total = stats.get(move, (0, 0))
+                stats[move] = (total[0] + wins, total[1] + visits)
+        if self.anytime:
+            move = max(stats, key=lambda m: stats[m][1])
         else:
-            move = succ.game.random_move(succ.board, succ.move)
-            new_node = succ.game.add_piece(succ.board, move, player)
-            node = Node(new_node, succ, move, succ.game, self.exploration_weight)
-            node.update_visits()
-            return node
+            move = max(stats, key=lambda m: stats[m][0] / stats[m][1])
+        return (stats[move][0] / stats[move][1], move)
 
-
-class Node:
-    def __init__(self, board, parent, move, game, exploration_weight=0.2):
+    def root_stats(self):
         """
 
-        :param board: current state of the game
-        :param parent: the parent of the node
-        :param move: the move used to get to this state
-        :param game: game object
-        :param exploration_weight: param for calculating the score
+        :return: the wins and visits of every root move
         """
-        self.board = board
-        self.parent = parent
-        self.move = move
-        self.wins = 0
-        self.visists = 1
-        self.game = game
-        self.children = []
-        self.score = 0
-        self.exploration_weight = exploration_weight
+        return {c.move: (c.wins, c.visists) for c in self.node.children}
 
-    def update_visits(self, vists=1):
+    def update_the_way(self, path, score_to_update):
         """
-
-        :param vists: update how many times this nodes was visited
+        this function updates the win/loses of every node
+        :param path: indices of the nodes from the root to the leaf
+        :param score_to_update: parameter to determine how to update
         :return: nothing
         """
-
-        self.visists += vists
-
-    def update_wins(self, wins):
+        game_result = self.game_result(score_to_update)
+        wins, visits = self.arena.wins, self.arena.visits
+        # wins are counted for the player that played the move of the node, the root player at odd depths
+        for depth in range(1, len(path)):
+            node = path[depth]
+            wins[node] += game_result if depth & 1 else -game_result
+            visits[node] += 1
+
+    def game_result(self, score):
         """
 
-        :param wins: wins score
+        :param score: which player won or the expected result for X of a truncated rollout
+        :return: 1 if the player of the root won, -1 if the opponent won, 0 if draw
+        """
+        if isinstance(score, float):
+            return score if self.player == "X" else -score
+        if self.player == score:
+            return 1
+        elif score == "D":
+            return 0
+        return -1
+
+    def update_amaf(self, path, rollout, score):
+        """
+        update the all moves as first statistics of the children of the nodes on the path, a child counts
+        the game if its player played its move later in the game
+        :param path: indices of the nodes from the root to the leaf
+        :param rollout: moves of the simulated game
+        :param score: which player won
         :return: nothing
         """
-        self.wins += wins
+        arena = self.arena
+        game_result = self.game_result(score)
+        moves = [arena.move[node] for node in path[1:]] + rollout
+        # every cell is played once in a game, the ply of the move played in every cell
+        ply = {move: i + 1 for i, move in enumerate(moves)}
+        amaf_visits, amaf_wins, move = arena.amaf_visits, arena.amaf_wins, arena.move
+        for depth, node in enumerate(path):
+            result = game_result if depth & 1 == 0 else -game_result
+            for c in arena.children(node):
+                played = ply.get(move[c], 0)
+                if played > depth and (played - depth) & 1:
+                    amaf_visits[c] += 1
+                    amaf_wins[c] += result
+
+    def get_succesor(self, node):
+        """
 
-    def get_parent(self):
+        :param node: node index
+        :return: child with the best score for the next select
+        """
+        if self.rave is not None:
+            return self.rave_succesor(node)
+        arena, weight = self.arena, self.exploration_weight
+        wins, visits = arena.wins, arena.visits
+        log_visits = 2 * math.log(visits[node])
+        best, best_score = -1, -math.inf
+        for c in arena.children(node):
+            score = wins[c] / visits[c] + weight * math.sqrt(log_visits / visits[c])
+            # ties go to the last child like the sorted selection did
+            if score >= best_score:
+                best, best_score = c, score
+        return best
+
+    def rave_succesor(self, node):
+        """
+        select with the UCT value blended with the all moves as first value,
+        the weight of the all moves as first value is sqrt(rave / (3 * visits + rave))
+        :param node: node index
+        :return: child with the best score for the next select
+        """
+        arena, weight, rave = self.arena, self.exploration_weight, self.rave
+        wins, visits, amaf_wins, amaf_visits = arena.wins, arena.visits, arena.amaf_wins, arena.amaf_visits
+        log_visits = 2 * math.log(visits[node])
+        best, best_score = -1, -math.inf
+        for c in arena.children(node):
+            value = wins[c] / visits[c]
+            if amaf_visits[c]:
+                beta = math.sqrt(rave / (3 * visits[c] + rave))
+                value = (1 - beta) * value + beta * amaf_wins[c] / amaf_visits[c]
+            score = value + weight * math.sqrt(log_visits / visits[c])
+            if score >= best_score:
+                best, best_score = c, score
+        return best
+
+    def expand_node(self, succ, board):
         """
 
-        :return: parent of this node
+        :param succ: node to be expanded
+        :param board: bit board of the node
+        :return: and expanded node which is the next state of current state
         """
-        return self.parent
+        arena = self.arena
+        if not arena.allocated(succ):
+            moves = board.possible_moves() if board.status() == "." else []
+            random.shuffle(moves)
+            arena.allocate(succ, moves)
+        if arena.fully_expanded(succ):
+            return succ
+        node = arena.expand(succ)
+        arena.visits[node] += 1
+        return node
 
-    def update_children(self):
+    def reuse(self, board, last_move, iterations):
+        """
+        move the root down to the state after our last move and the opponent's reply
+        :param board: current game state
+        :param last_move: last move by the opponent
+        :param iterations: number of iterations of the next search
+        :return: True if the state was found in the tree, False otherwise
         """
+        node = ROOT
+        for move in (self.played, last_move):
+            node = next((c for c in self.arena.children(node) if self.arena.move[c] == move), None)
+            if node is None:
+                return False
+        root_board = self.root_board.copy()
+        root_board.make(self.played)
+        root_board.make(last_move)
+        if root_board.to_string() != board:
+            return False
+        root_board.history = []
+        # copy the subtree of the new root so the rest of the tree can be freed
+        self.arena = self.arena.subtree(node)
+        self.node = Node(self.arena, ROOT)
+        self.root_board = root_board
+        self.board = board
+        self.last_move = last_move
+        self.iterations = iterations
+        return True
 
-        :return: generate all the children of the current state
+
+class Node:
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena, index):
+        """
+        view of a node of the arena
+        :param arena: node arena of the tree
+        :param index: index of the node
         """
+        self.arena = arena
+        self.index = index
 
-        for child in self.game.possible_moves(self.board, self.move):
-            node = Node(self.game.add_piece(deepcopy(self.board), child, self.game.opponent(self.board[self.move])),
-                        self, child, self.game, self.exploration_weight)
-            self.update_child(node)
+    @property
+    def move(self):
+        """
 
-    def get_children(self):
+        :return: the move used to get to this state
         """
+        return self.arena.move[self.index]
 
-        :return: return all the expanded children
+    @property
+    def wins(self):
         """
-        return self.children
 
-    def update_child(self, node):
+        :return: wins score
         """
+        return self.arena.wins[self.index]
 
-        :param node: child to update
-        :return: True if child was aded None if its already a child
+    @property
+    def visists(self):
         """
-        for i in self.children:
-            if node.board == i.board:
-                return None
-        self.children.append(node)
-        return True
 
-    def get_randon_child(self):
+        :return: how many times this node was visited
         """
+        return self.arena.visits[self.index]
 
-        :return: unexpanded random child of the current state
+    @property
+    def children(self):
         """
-        move = self.game.random_move(self.board, self.move)
-        node = Node(self.game.add_piece(deepcopy(self.board), move, self.game.opponent(self.board[self.move]))
-                    , self, move, self.game, self.exploration_weight)
-        while True:
-            if self.update_child(node) == True:
-                break
-            move = self.game.random_move(self.board, self.move)
-            node = Node(self.game.add_piece(deepcopy(self.board), move, self.game.opponent(self.board[self.move]))
-                        , self, move, self.game, self.exploration_weight)
 
-        return node
-    def get_succesor(self):
+        :return: the expanded children
         """
+        return [Node(self.arena, c) for c in self.arena.children(self.index)]
 
-        :return: score of the node for next select
+    def get_parent(self):
+        """
+
+        :return: parent of this node
         """
-        s = sorted(self.children, key=lambda c: c.wins / c.visists +self.exploration_weight*
-                                                 math.sqrt(2*math.log(self.visists) / c.visists))
-        return s[-1]
+        parent = self.arena.parent[self.index]
+        return Node(self.arena, parent) if parent >= 0 else None
@@ -0,0 +1,107 @@
+# =============================================================================
+# Legal move generation from precomputed tables.
+#
+# The moves in a box only depend on the 9 bit mask of its empty cells, so the
+# moves of every mask of every box are built once as a tuple, and the cells of
+# the open boxes are built once for every 9 bit mask of the closed boxes.  The
+# move generator is driven by the masks of the position itself, X, O and the
+# closed boxes, and gives the moves as an 81 bit mask or as a list.
+# =============================================================================
+from boxtable import FULL_BOX, OPEN, STATUS
+
+ALL_CELLS = (1 << 81) - 1
+X_BITS = str.maketrans("XO.", "100")
+O_BITS = str.maketrans("XO.", "010")
+
+# the string indices of every box
+BOX_INDICES = tuple(tuple(range(b * 9, b * 9 + 9)) for b in range(9))
+# the 81 bit mask of every box
+BOX_MASKS = tuple(FULL_BOX << (b * 9) for b in range(9))
+# the moves of every box for every 9 bit mask of its empty cells
+BOX_MOVES = tuple(tuple(tuple(b * 9 + i for i in range(9) if mask >> i & 1) for mask in range(512))
+                  for b in range(9))
+# the 81 bit mask of the open boxes for every 9 bit mask of the closed boxes
+OPEN_MASKS = tuple(sum(BOX_MASKS[b] for b in range(9) if not closed >> b & 1) for closed in range(512))
+
+
+def string_masks(state):
+    """
+
+    :param state: 81 characters state
+    :return: the 81 bit masks of X and O
+    """
+    state = state[::-1]
+    return int(state.translate(X_BITS), 2), int(state.translate(O_BITS), 2)
+
+
+def closed_boxes(x, o):
+    """
+
+    :param x: 81 bit mask of X
+    :param o: 81 bit mask of O
+    :return: 9 bit mask of the boxes won or drawn
+    """
+    closed = 0
+    for b in range(9):
+        shift = b * 9
+        if STATUS[((x >> shift) & FULL_BOX) | (((o >> shift) & FULL_BOX) << 9)] != OPEN:
+            closed |= 1 << b
+    return closed
+
+
+def legal_mask(x, o, closed, last_move):
+    """
+
+    :param x: 81 bit mask of X
+    :param o: 81 bit mask of O
+    :param closed: 9 bit mask of the closed boxes
+    :param last_move: last move played, -1 if none
+    :return: 81 bit mask of the legal moves
+    """
+    empty = ALL_CELLS & ~(x | o)
+    if last_move >= 0 and not closed >> (last_move % 9) & 1:
+        return empty & BOX_MASKS[last_move % 9]
+    return empty & OPEN_MASKS[closed]
+
+
+def move_list(x, o, closed, last_move):
+    """
+
+    :param x: 81 bit mask of X
+    :param o: 81 bit mask of O
+    :param closed: 9 bit mask of the closed boxes
+    :param last_move: last move played, -1 if none
+    :return: list of the legal moves, in increasing order
+    """
+    empty = ~(x | o)
+    if last_move >= 0:
+        b = last_move % 9
+        if not closed >> b & 1:
+            return list(BOX_MOVES[b][(empty >> (b * 9)) & FULL_BOX])
+    moves = []
+    for b in range(9):
+        if not closed >> b & 1:
+            moves += BOX_MOVES[b][(empty >> (b * 9)) & FULL_BOX]
+    return moves
+
+
+def perft(board, depth):
+    """
+    count the positions at the depth, a decided game has no moves
+    :param board: bit board to count from
+    :param depth: number of moves
+    :return: number of leaf positions
+    """
+    if depth == 0:
+        return 1
+    if board.status() != ".":
+        return 0
+    moves = board.possible_moves()
+    if depth == 1:
+        return len(moves)
+    count = 0
+    for move in moves:
+        board.make(move)
+        count += perft(board, depth - 1)
+        board.unmake()
+    return count
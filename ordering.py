@@ -0,0 +1,87 @@
+# =============================================================================
+# Move ordering for the alpha beta search.
+#
+# Moves are searched in this order:
+#   1. the best move stored in the transposition table (principal variation)
+#   2. moves that win a small box, then moves that block the opponent's box
+#   3. killer moves, the last moves that caused a cutoff at the same ply
+#   4. the rest by the history table, how much each move caused cutoffs
+# =============================================================================
+from boxtable import FULL_BOX, WIN
+
+TT_SCORE = 1 << 30
+WIN_SCORE = 1 << 29
+BLOCK_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+HISTORY_LIMIT = (1 << 26) - 1
+
+
+class MoveOrderer:
+    def __init__(self, killers=2):
+        """
+
+        :param killers: number of killer moves kept for every ply
+        """
+        self.killers_per_ply = killers
+        self.killers = [[] for _ in range(82)]
+        self.history = [[0] * 81 for _ in range(2)]
+
+    def clear(self):
+        """
+        forget the killer moves and the history of the last search
+        :return: nothing
+        """
+        self.killers = [[] for _ in range(82)]
+        self.history = [[0] * 81 for _ in range(2)]
+
+    def tactical_score(self, board, move):
+        """
+
+        :param board: current bit board
+        :param move: legal move
+        :return: score for winning or blocking the small box of the move, 0 otherwise
+        """
+        shift = (move // 9) * 9
+        bit = 1 << (move - shift)
+        if WIN[((board.pieces[board.side] >> shift) & FULL_BOX) | bit]:
+            return WIN_SCORE
+        if WIN[((board.pieces[board.side ^ 1] >> shift) & FULL_BOX) | bit]:
+            return BLOCK_SCORE
+        return 0
+
+    def order(self, board, succ, tt_move=None):
+        """
+
+        :param board: current bit board
+        :param succ: legal moves
+        :param tt_move: best move stored in the transposition table
+        :return: the moves sorted by the order they should be searched
+        """
+        killers = self.killers[len(board.history)]
+        history = self.history[board.side]
+        scores = {}
+        for s in succ:
+            if s == tt_move:
+                scores[s] = TT_SCORE
+            else:
+                score = self.tactical_score(board, s)
+                if not score and s in killers:
+                    score = KILLER_SCORE + self.killers_per_ply - killers.index(s)
+                scores[s] = score or history[s]
+        return sorted(succ, key=scores.__getitem__, reverse=True)
+
+    def cutoff(self, board, move, depth):
+        """
+
+        :param board: bit board the cutoff happened in
+        :param move: move that caused the cutoff
+        :param depth: depth left to search from the board
+        :return: nothing
+        """
+        killers = self.killers[len(board.history)]
+        if move in killers:
+            killers.remove(move)
+        killers.insert(0, move)
+        del killers[self.killers_per_ply:]
+        history = self.history[board.side]
+        history[move] = min(history[move] + depth * depth, HISTORY_LIMIT)
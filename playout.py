@@ -0,0 +1,199 @@
+# =============================================================================
+# Random playouts for the monte carlo search.
+#
+# The engine keeps the game in a few preallocated lists of 9 bit masks, one
+# mask per box for the X cells, the O cells and the empty cells, and picks the
+# random moves straight from the masks of the empty cells, so a playout does
+# not copy the state or build lists of moves.
+# =============================================================================
+import random
+
+from boxtable import DRAW, FULL_BOX, O_WON, OPEN, STATUS, WIN, X_WON
+
+X_BITS = str.maketrans("XO.", "100")
+O_BITS = str.maketrans("XO.", "010")
+
+# the cells of every 9 bit mask and the number of cells
+CELLS = tuple(tuple(i for i in range(9) if mask >> i & 1) for mask in range(512))
+COUNT = tuple(len(cells) for cells in CELLS)
+# the empty cells that complete a line of the player for every 9 bit mask of the player
+THREATS = tuple(sum(1 << i for i in range(9) if not mask >> i & 1 and WIN[mask | 1 << i]) for mask in range(512))
+
+
+class Playout:
+    __slots__ = ("boxes", "empty", "macro", "closed", "side", "last_move", "open_cells", "rand")
+
+    def __init__(self, rand=None):
+        """
+
+        :param rand: random generator, the random module if None
+        """
+        self.boxes = [[0] * 9, [0] * 9]
+        self.empty = [FULL_BOX] * 9
+        self.macro = [0, 0]
+        self.closed = 0
+        self.side = 0
+        self.last_move = -1
+        self.open_cells = 81
+        self.rand = rand or random
+
+    def load_string(self, state, last_move, player):
+        """
+
+        :param state: 81 characters state to play from
+        :param last_move: last move played
+        :param player: player to move
+        :return: nothing
+        """
+        state = state[::-1]
+        self.load(int(state.translate(X_BITS), 2), int(state.translate(O_BITS), 2), last_move, player == "O")
+
+    def load_board(self, board):
+        """
+
+        :param board: bit board to play from
+        :return: nothing
+        """
+        self.load(board.pieces[0], board.pieces[1], board.last_move, board.side)
+
+    def load(self, x, o, last_move, side):
+        """
+
+        :param x: 81 bit mask of X
+        :param o: 81 bit mask of O
+        :param last_move: last move played
+        :param side: 0 if X is to move, 1 if O is to move
+        :return: nothing
+        """
+        boxes_x, boxes_o, empty = self.boxes[0], self.boxes[1], self.empty
+        macro_x = macro_o = closed = 0
+        open_cells = 0
+        for b in range(9):
+            bx = (x >> (b * 9)) & FULL_BOX
+            bo = (o >> (b * 9)) & FULL_BOX
+            boxes_x[b] = bx
+            boxes_o[b] = bo
+            empty[b] = FULL_BOX ^ (bx | bo)
+            status = STATUS[bx | (bo << 9)]
+            if status == OPEN:
+                open_cells += COUNT[empty[b]]
+            else:
+                closed |= 1 << b
+                if status == X_WON:
+                    macro_x |= 1 << b
+                elif status == O_WON:
+                    macro_o |= 1 << b
+        self.macro[0] = macro_x
+        self.macro[1] = macro_o
+        self.closed = closed
+        self.side = int(side)
+        self.last_move = last_move
+        self.open_cells = open_cells
+
+    def result(self):
+        """
+
+        :return: the winner if there is one or D if draw or . if nothing yet
+        """
+        if WIN[self.macro[0]]:
+            return "X"
+        if WIN[self.macro[1]]:
+            return "O"
+        if self.closed == FULL_BOX:
+            return "D"
+        return "."
+
+    def run(self, moves=None, plies=None, epsilon=1.0):
+        """
+        play moves until the game is decided, random moves or with probability 1 - epsilon a move that
+        wins a box, else one that blocks the opponent from winning a box
+        :param moves: list that gets the moves played, not recorded if None
+        :param plies: most moves played, the game is played to the end if None
+        :param epsilon: probability of a random move, 1 plays only random moves
+        :return: which player won or . if the plies ran out first
+        """
+        result = self.result()
+        if result != ".":
+            return result
+        boxes, empty, macro = self.boxes, self.empty, self.macro
+        randrange, random = self.rand.randrange, self.rand.random
+        side = self.side
+        closed = self.closed
+        open_cells = self.open_cells
+        last_move = self.last_move
+        b = last_move % 9 if last_move >= 0 else -1
+        greedy = epsilon < 1.0
+        # a game has at most 81 moves
+        for _ in range(81 if plies is None else plies):
+            free = b < 0 or closed >> b & 1
+            found = None
+            if greedy and random() >= epsilon:
+                found = self.tactical(-1 if free else b, side, closed)
+            if found is not None:
+                b, cell = found
+            elif free:
+                # play anywhere, every empty cell of the open boxes is as likely
+                r = randrange(open_cells)
+                for b in range(9):
+                    if not closed >> b & 1:
+                        count = COUNT[empty[b]]
+                        if r < count:
+                            break
+                        r -= count
+                cell = CELLS[empty[b]][r]
+            else:
+                cells = CELLS[empty[b]]
+                cell = cells[randrange(len(cells))]
+            last_move = b * 9 + cell
+            if moves is not None:
+                moves.append(last_move)
+            bit = 1 << cell
+            boxes[side][b] |= bit
+            empty[b] ^= bit
+            open_cells -= 1
+            status = STATUS[boxes[0][b] | (boxes[1][b] << 9)]
+            side ^= 1
+            if status != OPEN:
+                closed |= 1 << b
+                open_cells -= COUNT[empty[b]]
+                if status != DRAW:
+                    macro[side ^ 1] |= 1 << b
+                    if WIN[macro[side ^ 1]]:
+                        result = "XO"[side ^ 1]
+                        break
+                if closed == FULL_BOX:
+                    result = "D"
+                    break
+            b = cell
+        self.side = side
+        self.closed = closed
+        self.open_cells = open_cells
+        self.last_move = last_move
+        return result
+
+    def tactical(self, b, side, closed):
+        """
+
+        :param b: box the player must play in, -1 if the player can play anywhere
+        :param side: 0 if X is to move, 1 if O is to move
+        :param closed: mask of the closed boxes
+        :return: (box, cell) of a random move that wins a box, else that blocks a box, None if there is none
+        """
+        boxes, empty = self.boxes, self.empty
+        candidates = [b] if b >= 0 else [i for i in range(9) if not closed >> i & 1]
+        for player in (side, side ^ 1):
+            found = [(i, cells) for i in candidates for cells in (THREATS[boxes[player][i]] & empty[i],) if cells]
+            if found:
+                i, cells = found[self.rand.randrange(len(found))]
+                cells = CELLS[cells]
+                return i, cells[self.rand.randrange(len(cells))]
+        return None
+
+    def to_string(self):
+        """
+
+        :return: 81 characters state of the game
+        """
+        boxes_x, boxes_o = self.boxes
+        return "".join("X" if boxes_x[i // 9] >> (i % 9) & 1 else "O" if boxes_o[i // 9] >> (i % 9) & 1 else "."
+                       for i in range(81))
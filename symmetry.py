@@ -0,0 +1,150 @@
+# =============================================================================
+# The 8 symmetries of the board.
+#
+# A symmetry of the square (rotations and reflections) moves the cells of a
+# 3x3 grid, the same map moves the boxes of the macro board and the cells in
+# every box, so index b*9+c goes to T(b)*9+T(c).  Since the box a player is
+# sent to is the cell of the last move, the forced box goes to T(forced) and
+# the rules are the same in the transformed game.
+# A canonical form is the transformed position with the smallest key, with
+# the transform kept to map the moves found on it back to the real game.
+# =============================================================================
+from boxtable import FULL_BOX
+from movegen import closed_boxes, string_masks
+
+
+def grid_map(transpose, flip_rows, flip_cols):
+    """
+
+    :param transpose: True to swap rows and columns first
+    :param flip_rows: True to reverse the rows
+    :param flip_cols: True to reverse the columns
+    :return: tuple of the cell every cell of a 3x3 grid goes to
+    """
+    cells = []
+    for i in range(9):
+        r, c = divmod(i, 3)
+        if transpose:
+            r, c = c, r
+        if flip_rows:
+            r = 2 - r
+        if flip_cols:
+            c = 2 - c
+        cells.append(r * 3 + c)
+    return tuple(cells)
+
+
+# transform 0 is the identity
+CELL_MAPS = tuple(grid_map(t & 4, t & 2, t & 1) for t in range(8))
+INVERSES = tuple(next(u for u in range(8) if all(CELL_MAPS[u][CELL_MAPS[t][i]] == i for i in range(9)))
+                 for t in range(8))
+# the index every index of the string state goes to
+INDEX_MAPS = tuple(tuple(cells[i // 9] * 9 + cells[i % 9] for i in range(81)) for cells in CELL_MAPS)
+# the transformed 9 bit mask of every 9 bit mask
+MASK_MAPS = tuple(tuple(sum(1 << cells[i] for i in range(9) if mask >> i & 1) for mask in range(512))
+                  for cells in CELL_MAPS)
+
+
+def transform_move(move, t):
+    """
+
+    :param move: index of a move, -1 for no move
+    :param t: transform number
+    :return: index of the move in the transformed game
+    """
+    return INDEX_MAPS[t][move] if move >= 0 else move
+
+
+def inverse_move(move, t):
+    """
+
+    :param move: index of a move in the transformed game
+    :param t: transform number the game was transformed with
+    :return: index of the move in the real game
+    """
+    return transform_move(move, INVERSES[t])
+
+
+def transform_state(state, t):
+    """
+
+    :param state: 81 characters state
+    :param t: transform number
+    :return: the transformed state
+    """
+    cells = [""] * 81
+    for i, j in enumerate(INDEX_MAPS[t]):
+        cells[j] = state[i]
+    return "".join(cells)
+
+
+def transform_mask(mask, t):
+    """
+
+    :param mask: 81 bit mask of cells, a 9 bit mask of boxes is transformed with MASK_MAPS[t]
+    :param t: transform number
+    :return: the transformed mask
+    """
+    boxes, masks = CELL_MAPS[t], MASK_MAPS[t]
+    result = 0
+    for b in range(9):
+        result |= masks[(mask >> (b * 9)) & FULL_BOX] << (boxes[b] * 9)
+    return result
+
+
+def forced_of(closed, last_move):
+    """
+
+    :param closed: 9 bit mask of the closed boxes
+    :param last_move: last move played, -1 if none
+    :return: the box the player must play in, 9 if the player can play anywhere
+    """
+    if last_move >= 0 and not closed >> (last_move % 9) & 1:
+        return last_move % 9
+    return 9
+
+
+def transform_forced(forced, t):
+    """
+
+    :param forced: box the player must play in, 9 if anywhere
+    :param t: transform number
+    :return: the forced box in the transformed game
+    """
+    return CELL_MAPS[t][forced] if forced < 9 else 9
+
+
+def canonical(state, last_move):
+    """
+
+    :param state: 81 characters state
+    :param last_move: last move played, -1 if none
+    :return: (state, last move, t) of the transform with the smallest (state, forced box, last move),
+             the moves of the canonical game go back to the real game with inverse_move(move, t)
+    """
+    x, o = string_masks(state)
+    forced = forced_of(closed_boxes(x, o), last_move)
+    best = None
+    for t in range(8):
+        key = (transform_state(state, t), transform_forced(forced, t), transform_move(last_move, t))
+        if best is None or key < best[0]:
+            best = (key, t)
+    (state, forced, last_move), t = best
+    return state, last_move, t
+
+
+def canonical_key(board):
+    """
+
+    :param board: bit board
+    :return: (key, t) of the transform with the smallest key (x, o, forced box, side), the key is the same
+             for all the symmetric positions with the same player to move
+    """
+    x, o = board.pieces
+    forced = forced_of(board.closed(), board.last_move)
+    best = None
+    for t in range(8):
+        key = (transform_mask(x, t), transform_mask(o, t), transform_forced(forced, t), board.side)
+        if best is None or key < best[0]:
+            best = (key, t)
+    return best
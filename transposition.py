@@ -0,0 +1,111 @@
+# =============================================================================
+# Zobrist hashing and transposition table for the minimax searches.
+#
+# A position is hashed from its pieces, the player to move and the box the
+# player is forced to play in (9 when the player can play anywhere).
+# The table is split in buckets of two slots, the first slot keeps the entry
+# searched the deepest and the second slot is always replaced.
+# =============================================================================
+import random
+
+_random = random.Random(0x5EED)
+PIECE_KEYS = [[_random.getrandbits(64) for _ in range(81)] for _ in range(2)]
+SIDE_KEY = _random.getrandbits(64)
+FORCED_KEYS = [_random.getrandbits(64) for _ in range(10)]
+CHANCE_KEY = _random.getrandbits(64)
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 16, enabled=True):
+        """
+
+        :param size: number of buckets, rounded down to a power of two
+        :param enabled: False for a table that stores nothing, to measure the search without it
+        """
+        self.enabled = enabled
+        self.size = 1 << (size.bit_length() - 1)
+        self.mask = self.size - 1
+        self.slots = [None] * (2 * self.size)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    def clear(self):
+        """
+        remove all the entries and reset the counters
+        :return: nothing
+        """
+        self.slots = [None] * (2 * self.size)
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+
+    def probe(self, key):
+        """
+
+        :param key: zobrist key of the position
+        :return: the entry (key, depth, flag, value, move) or None if the position is not stored
+        """
+        if not self.enabled:
+            return None
+        i = (key & self.mask) << 1
+        first = self.slots[i]
+        if first is not None and first[0] == key:
+            self.hits += 1
+            return first
+        second = self.slots[i + 1]
+        if second is not None and second[0] == key:
+            self.hits += 1
+            return second
+        if first is not None or second is not None:
+            self.collisions += 1
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, flag, value, move):
+        """
+
+        :param key: zobrist key of the position
+        :param depth: depth the position was searched to
+        :param flag: EXACT, LOWER or UPPER bound of the value
+        :param value: score of the position
+        :param move: best move found
+        :return: nothing
+        """
+        if not self.enabled:
+            return
+        i = (key & self.mask) << 1
+        first = self.slots[i]
+        self.stores += 1
+        if first is None or first[0] == key or depth >= first[1]:
+            self.slots[i] = (key, depth, flag, value, move)
+        else:
+            self.slots[i + 1] = (key, depth, flag, value, move)
+
+    def __getstate__(self):
+        """
+
+        :return: only the size and the switch are pickled, the entries are not sent to other processes
+        """
+        return {"size": self.size, "enabled": self.enabled}
+
+    def __setstate__(self, state):
+        """
+
+        :param state: pickled size and switch
+        :return: nothing
+        """
+        self.__init__(state["size"], state.get("enabled", True))
+
+    def stats(self):
+        """
+
+        :return: the hit, miss, collision and store counters
+        """
+        probes = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "collisions": self.collisions,
+                "stores": self.stores, "hit_rate": self.hits / probes if probes else 0.0}
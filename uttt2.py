@@ -1,6 +1,8 @@
 import random
 from contextlib import contextmanager
 import sys, os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # =============================================================================
 # State is stored as a string where index is at place shown in the board below
@@ -22,12 +24,24 @@ import sys, os
 # =============================================================================
 from copy import deepcopy
 
-from math import inf
+from fractions import Fraction
+from math import inf, nextafter
 from collections import Counter
 from time import time
 
+from bitboard import BitBoard
+from book import load_book
+from endgame import LOSS_VALUE, EndgameSolver
+from boxtable import string_status
+from movegen import BOX_INDICES, closed_boxes, move_list, string_masks
+from ordering import MoveOrderer
+from transposition import CHANCE_KEY, EXACT, LOWER, UPPER, TranspositionTable
 from heuristics import heuristics
-from monte import MCTS
+from monte import MCTS, RolloutPolicy
+
+MATE_SCORE = 10 ** 9
+
+
 def index(x, y):
     """
 
@@ -62,6 +76,13 @@ def next_box(i):
 
 
 
+class SearchTimeout(Exception):
+    """
+    raised inside the search when the time of the move is over
+    """
+    pass
+
+
 def print_board(state):
     """
 
@@ -97,6 +118,16 @@ class ultiTic:
         self.state = init_state
         self.box_won = "." * 9
         self.state = "." * 81
+        self.tt = TranspositionTable()
+        self.orderer = MoveOrderer()
+        self.nodes = 0
+        self.deadline = None
+        self.completed_depth = 0
+        self.chance_pruning = True
+        self.pools = dict()
+        self.trees = dict()
+        self.book = load_book()
+        self.endgame = EndgameSolver()
 
     def add_piece(self, state, move, player):
         """
@@ -119,13 +150,15 @@ class ultiTic:
         :param b: box number
         :return: the box state
         """
-        return list(range(b * 9, b * 9 + 9))
+        return BOX_INDICES[b]
     def update_box_won(self, state):
         """
 
         :param state: current state
         :return: current game win/lose status
         """
+        if isinstance(state, BitBoard):
+            return state.box_won()
         temp_box_win = ["."] * 9
         for b in range(9):
             idxs_box = self.indices_of_box(b)
@@ -133,20 +166,36 @@ class ultiTic:
             temp_box_win[b] = self.check_small_box(box_str)
         return temp_box_win
 
+    def update_move_box(self, state, box_won, move):
+        """
+
+        :param state: state after the move
+        :param box_won: small boxes status before the move
+        :param move: move that was played
+        :return: small boxes status after the move, only the box of the move is checked
+        """
+        b = move // 9
+        box_won = list(box_won)
+        box_won[b] = self.check_small_box(state[b * 9: b * 9 + 9])
+        return box_won
+
+    def game_status(self, state):
+        """
+
+        :param state: current state
+        :return: the winner if there is one or D if draw or . if nothing yet
+        """
+        if isinstance(state, BitBoard):
+            return state.status()
+        return self.check_small_box(self.update_box_won(state))
+
     def check_small_box(self, box_str):
         """
 
         :param box_str: small game box
         :return: the winner if there is one or D if draw or . if nothing yet
         """
-
-        for idxs in self.possible_goals:
-            (x, y, z) = idxs
-            if (box_str[x] == box_str[y] == box_str[z]) and box_str[x] != "." and box_str[x] != "D":
-                return box_str[x]
-        if "." not in box_str:
-            return "D"
-        return "."
+        return string_status(box_str)
 
     def possible_moves(self, state, last_move):
         """
@@ -155,15 +204,23 @@ class ultiTic:
         :param last_move: last move was played by opponent
         :return: list of legal moves for current player
         """
-        cur_state=["."]
-        if (last_move != -1):
-            cur_state = [state[i] for i in self.indices_of_box(last_move % 9)]
+        if isinstance(state, BitBoard):
+            return state.possible_moves()
         if not isinstance(last_move, int):
             last_move = index(last_move[0], last_move[1])
-        if (last_move == -1 or self.box_won[(last_move % 9)] != ".") or "." not in cur_state:
-            return [i for i in range(81) if (state[i] == "." and self.box_won[(i // 9)] == ".")]
-        return [i for i in self.indices_of_box(last_move % 9) if state[i] == "."]
+        # the closed boxes come from the state itself
+        x, o = string_masks(state)
+        return move_list(x, o, closed_boxes(x, o), last_move)
 
+    def macro_of(self, state):
+        """
+
+        :param state: current state
+        :return: the small boxes status of the state, the game's one for string states
+        """
+        if isinstance(state, BitBoard):
+            return state.box_won()
+        return self.box_won
 
 
     def opponent(self, p):
@@ -174,7 +231,7 @@ class ultiTic:
         """
         return "O" if p == "X" else "X"
 
-    def expectimax(self, state, last_move, player, depth, eval):
+    def expectimax(self, state, last_move, player, depth, eval, workers=1):
         """
 
         :param state: current state
@@ -182,42 +239,264 @@ class ultiTic:
         :param player: cureent player
         :param depth: minimax depth
         :param eval: evaluation function
+        :param workers: number of processes searching the root moves
         :return: best move to be played by the player
         """
-        succ = self.possible_moves(state, last_move)
+        self.new_search()
+        board = BitBoard(state, last_move, player)
+        return self.search_root(board, board.possible_moves(), depth, eval, self.expecti_min_turn, workers)[1]
+
+    def new_search(self):
+        """
+        forget the tables of the last search
+        :return: nothing
+        """
+        self.tt.clear()
+        if self.orderer is not None:
+            self.orderer.clear()
+        self.nodes = 0
+
+    def search_root(self, board, succ, depth, eval, turn, workers=1):
+        """
+
+        :param board: bit board of the root, the player to move is the player
+        :param succ: root moves in the order to search them
+        :param depth: minimax depth
+        :param eval: evaluation function
+        :param turn: search function of the opponent's turn
+        :param workers: number of processes searching the root moves
+        :return: the best score and the best move
+        """
+        if workers > 1 and len(succ) > 1:
+            return self.parallel_search_root(board, succ, depth, eval, turn, workers)
         best_move = (-inf, None)
+        # a chance node can stop as soon as its average can't be better than the best move
+        chance = turn == self.expecti_min_turn
         for s in succ:
-            new_state = self.add_piece(state, s, player)
-            val = self.expecti_min_turn(new_state, s, self.opponent(player), depth - 1,
-                                        -inf, inf, eval)
+            board.make(s)
+            val = turn(board, depth - 1, best_move[0] if chance else -inf, inf, eval)
+            board.unmake()
             if val > best_move[0]:
                 best_move = (val, s)
-        return best_move[1]
+        return best_move
+
+    def parallel_search_root(self, board, succ, depth, eval, turn, workers):
+        """
+        search the first root move here, then the other root moves in a process pool
+        with the best score found so far shared between the processes as alpha
+        :param board: bit board of the root, the player to move is the player
+        :param succ: root moves in the order to search them
+        :param depth: minimax depth
+        :param eval: evaluation function
+        :param turn: search function of the opponent's turn
+        :param workers: number of processes
+        :return: the best score and the best move, the same as the serial search
+        """
+        board.make(succ[0])
+        scores = {succ[0]: turn(board, depth - 1, -inf, inf, eval)}
+        board.unmake()
+        exact = {succ[0]}
+        # a chance node can only use alpha when it prunes
+        share_alpha = turn == self.min_turn or self.chance_pruning
+        pool, shared_alpha = self.process_pool(workers)
+        shared_alpha.value = scores[succ[0]]
+        state = board.to_string()
+        futures = [pool.submit(search_root_move, state, board.last_move, board.player, s, depth, eval,
+                               turn.__name__, share_alpha, self.deadline, self.orderer, self.chance_pruning)
+                   for s in succ[1:]]
+        for future in futures:
+            move, val, alpha, nodes = future.result()
+            scores[move] = val
+            self.nodes += nodes
+            if val > alpha:
+                exact.add(move)
+        best = max(scores[s] for s in exact)
+        best_move = (-inf, None)
+        for s in succ:
+            if s not in exact and scores[s] >= best:
+                # the bound ties the best score, the serial search would keep the first move of a tie
+                board.make(s)
+                scores[s] = turn(board, depth - 1, -inf, inf, eval)
+                board.unmake()
+            if scores[s] > best_move[0]:
+                best_move = (scores[s], s)
+        return best_move
+
+    def process_pool(self, workers):
+        """
 
-    def expecti_min_turn(self, state, last_move, player, depth, alpha, beta, eval):
+        :param workers: number of processes
+        :return: the process pool with this number of processes and its shared alpha
+        """
+        if workers not in self.pools:
+            shared_alpha = multiprocessing.Value("d", -inf)
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_search_worker,
+                                       initargs=(shared_alpha,))
+            self.pools[workers] = (pool, shared_alpha)
+        return self.pools[workers]
+
+    def iterative_deepening(self, state, last_move, player, max_depth, eval, time_limit, turn, workers=1):
         """
 
         :param state: current state
         :param last_move: last move played
         :param player: cureent player
+        :param max_depth: deepest iteration to search
+        :param eval: evaluation function
+        :param time_limit: seconds the search may take
+        :param turn: search function of the opponent's turn
+        :param workers: number of processes searching the root moves
+        :return: best move of the deepest completed iteration
+        """
+        self.new_search()
+        board = BitBoard(state, last_move, player)
+        succ = board.possible_moves()
+        best = succ[0] if succ else None
+        empty = 81 - board.filled()
+        deadline = time() + time_limit
+        try:
+            for depth in range(1, min(max_depth, empty) + 1):
+                # depth 1 always finishes so the move played was searched
+                self.deadline = deadline if depth > 1 else None
+                # the best move of the last iteration is searched first, deeper
+                # moves of the principal variation come from the transposition table
+                succ = self.tt_first(succ, best)
+                best = self.search_root(board, succ, depth, eval, turn, workers)[1]
+                self.completed_depth = depth
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+        return best
+
+    def expecti_min_turn(self, board, depth, alpha, beta, eval):
+        """
+        average of the opponent's moves, with the score bounds declared by the evaluation function the
+        average is cut as soon as it can't end inside the window whatever the children left score (Star1),
+        every child is searched with the window of the scores that keep the average inside, so a child out
+        of its window cuts the average too, a cut average returns alpha or beta and an average inside the
+        window is the same as without cuts
+        :param board: current bit board, the player to move is the opponent
         :param depth: minimax depth
         :param alpha: param for the algorithm
         :param beta: param for the algorithm
         :param eval: evaluation function
         :return: best move to be played by the player
         """
-
-        if depth <= 0 or self.check_small_box(self.box_won) != ".":  # or time() - s_time >= 10:
-            return eval(self,state, last_move, self.opponent(player))
-        succ = self.possible_moves(state, last_move)
+        self.nodes += 1
+        self.check_time()
+        if board.status() != ".":
+            return self.terminal_score(board, board.opponent)
+        if depth <= 0:
+            return eval(self, board, board.last_move, board.opponent)
+        succ = board.possible_moves()
+        bounds = self.chance_bounds(board, depth, eval)
+        if bounds is None:
+            # every child is searched with the full window so the average is exact
+            alpha, beta = -inf, inf
+        key = board.key() ^ CHANCE_KEY
+        entry = self.tt.probe(key)
+        if entry is not None:
+            value = self.tt_cutoff(entry, depth, alpha, beta)
+            if value is not None:
+                return value
+        n = len(succ)
+        if bounds is not None:
+            cut = self.chance_cut(0, n, n, bounds, alpha, beta)
+            if cut is not None:
+                self.tt.store(key, depth, LOWER if cut >= beta else UPPER, cut, None)
+                return cut
         expicti_val = 0
-        for s in succ:
-            new_state = self.add_piece(state, s, player)
-            val = self.max_turn(new_state, s, self.opponent(player), depth - 1,
-                                alpha, beta, eval)
+        # the exact sum of the scores, the cuts are decided on it
+        total = 0
+        for i, s in enumerate(succ):
+            left = n - i - 1
+            board.make(s)
+            if bounds is None:
+                val = self.max_turn(board, depth - 1, alpha, beta, eval)
+            else:
+                child_alpha, child_beta = self.child_window(total, left, n, bounds, alpha, beta)
+                val = self.max_turn(board, depth - 1, child_alpha, child_beta, eval)
+            board.unmake()
+            if bounds is not None and (val <= child_alpha or val >= child_beta):
+                cut = alpha if val <= child_alpha else beta
+                self.tt.store(key, depth, LOWER if cut >= beta else UPPER, cut, None)
+                return cut
             expicti_val += val / len(succ)
+            total += val
+            if bounds is not None:
+                cut = self.chance_cut(total, left, n, bounds, alpha, beta)
+                if cut is not None:
+                    self.tt.store(key, depth, LOWER if cut >= beta else UPPER, cut, None)
+                    return cut
+        self.tt.store(key, depth, EXACT, expicti_val, None)
         return expicti_val
-    def minimax(self, state, last_move, player, depth, eval):
+
+    def chance_bounds(self, board, depth, eval):
+        """
+
+        :param board: bit board of a chance node, the player to move is the opponent
+        :param depth: minimax depth of the chance node
+        :param eval: evaluation function
+        :return: (low, high) the lowest and highest score of the children of the chance node, a side that can
+                 win in the moves left to it can reach a mate score, None if the chance node can't prune
+        """
+        bounds = getattr(eval, "bounds", None)
+        if not self.chance_pruning or bounds is None:
+            return None
+        low, high = bounds
+        # the opponent plays the first of the depth moves
+        if board.moves_to_win(board.side) <= (depth + 1) // 2:
+            low = -MATE_SCORE
+        if board.moves_to_win(board.side ^ 1) <= depth // 2:
+            high = MATE_SCORE
+        return low, high
+
+    def chance_cut(self, total, left, n, bounds, alpha, beta):
+        """
+        the sum of the children left at the lowest and the highest score, compared exactly with the window
+        :param total: sum of the scores of the children searched
+        :param left: number of children not searched yet
+        :param n: number of children
+        :param bounds: lowest and highest score of a child
+        :param alpha: param for the algorithm
+        :param beta: param for the algorithm
+        :return: alpha if the average can't be above alpha, beta if it can't be below beta, None otherwise
+        """
+        low, high = bounds
+        if alpha > -inf and Fraction(total) + left * high <= n * Fraction(alpha):
+            return alpha
+        if beta < inf and Fraction(total) + left * low >= n * Fraction(beta):
+            return beta
+        return None
+
+    def child_window(self, total, left, n, bounds, alpha, beta):
+        """
+        the scores of the next child where the average is out of the window whatever the children after it
+        score, rounded outwards so a child out of its window always cuts the average
+        :param total: sum of the scores of the children searched
+        :param left: number of children after the next one
+        :param n: number of children
+        :param bounds: lowest and highest score of a child
+        :param alpha: param for the algorithm
+        :param beta: param for the algorithm
+        :return: (alpha, beta) of the next child
+        """
+        low, high = bounds
+        child_alpha, child_beta = -inf, inf
+        if alpha > -inf:
+            exact = n * Fraction(alpha) - Fraction(total) - left * high
+            child_alpha = float(exact)
+            if child_alpha > exact:
+                child_alpha = nextafter(child_alpha, -inf)
+        if beta < inf:
+            exact = n * Fraction(beta) - Fraction(total) - left * low
+            child_beta = float(exact)
+            if child_beta < exact:
+                child_beta = nextafter(child_beta, inf)
+        return child_alpha, child_beta
+
+    def minimax(self, state, last_move, player, depth, eval, workers=1):
         """
 
         :param state: current state
@@ -225,67 +504,169 @@ class ultiTic:
         :param player: cureent player
         :param depth: minimax depth
         :param eval: evaluation function
+        :param workers: number of processes searching the root moves
         :return: best move to be played by the player
         """
-        succ = self.possible_moves(state, last_move)
-        best_move = (-inf, None)
-        for s in succ:
-            new_state = self.add_piece(state, s, player)
-            val = self.min_turn(new_state, s, self.opponent(player), depth - 1,
-                                -inf, inf, eval)
-            if val > best_move[0]:
-                best_move = (val, s)
-        return best_move[1]
+        self.new_search()
+        board = BitBoard(state, last_move, player)
+        return self.search_root(board, board.possible_moves(), depth, eval, self.min_turn, workers)[1]
 
-    def min_turn(self, state, last_move, player, depth, alpha, beta, eval):
+    def check_time(self):
+        """
+        stop the search when the time of the move is over
+        :return: nothing
         """
+        if self.deadline is not None and time() >= self.deadline:
+            raise SearchTimeout()
 
-        :param state: current state
-        :param last_move: last move played
-        :param player: cureent player
+    def terminal_score(self, board, player):
+        """
+
+        :param board: bit board of a decided game
+        :param player: player the score is for
+        :return: score of the result, wins in less moves score higher
+        """
+        result = board.status()
+        if result == "D":
+            return 0
+        score = MATE_SCORE - board.filled()
+        return score if result == player else -score
+
+    def tt_cutoff(self, entry, depth, alpha, beta):
+        """
+
+        :param entry: transposition table entry of the position
+        :param depth: depth the position has to be searched to
+        :param alpha: alpha param
+        :param beta: beta param
+        :return: the stored score if it can be used without searching, None otherwise
+        """
+        if entry[1] < depth:
+            return None
+        flag, value = entry[2], entry[3]
+        if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+            return value
+        return None
+
+    def tt_store(self, board, depth, alpha, beta, value, move):
+        """
+
+        :param board: searched bit board
+        :param depth: depth the position was searched to
+        :param alpha: alpha param the position was searched with
+        :param beta: beta param the position was searched with
+        :param value: score returned by the search
+        :param move: best move found
+        :return: nothing
+        """
+        if value <= alpha:
+            flag = UPPER
+        elif value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(board.key(), depth, flag, value, move)
+
+    def order_moves(self, board, succ, entry):
+        """
+
+        :param board: current bit board
+        :param succ: legal moves
+        :param entry: transposition table entry of the position or None
+        :return: the moves in the order to search them
+        """
+        tt_move = entry[4] if entry is not None else None
+        if self.orderer is None:
+            return self.tt_first(succ, tt_move)
+        return self.orderer.order(board, succ, tt_move)
+
+    def tt_first(self, succ, move):
+        """
+
+        :param succ: legal moves
+        :param move: best move stored in the transposition table
+        :return: the moves with the stored move searched first
+        """
+        if move is None or move not in succ:
+            return succ
+        return [move] + [s for s in succ if s != move]
+
+    def min_turn(self, board, depth, alpha, beta, eval):
+        """
+
+        :param board: current bit board, the player to move is the opponent
         :param depth: minimax depth
         :param alpha: alpha param
         :param beta: beta param
         :param eval: evaluation function used to evaluate
         :return: score for the state
         """
-        if depth <= 0 or self.check_small_box(self.box_won) != ".":  # or time() - s_time >= 10:
-            return eval(self,state, last_move, self.opponent(player))
-        succ = self.possible_moves(state, last_move)
+        self.nodes += 1
+        self.check_time()
+        if board.status() != ".":
+            return self.terminal_score(board, board.opponent)
+        if depth <= 0:
+            return eval(self, board, board.last_move, board.opponent)
+        succ = board.possible_moves()
+        entry = self.tt.probe(board.key())
+        if entry is not None:
+            value = self.tt_cutoff(entry, depth, alpha, beta)
+            if value is not None:
+                return value
+        succ = self.order_moves(board, succ, entry)
+        alpha_orig, beta_orig = alpha, beta
+        best = None
         for s in succ:
-            new_state = self.add_piece(state, s, player)
-            val = self.max_turn(new_state, s, self.opponent(player), depth - 1,
-                                alpha, beta, eval)
+            board.make(s)
+            val = self.max_turn(board, depth - 1, alpha, beta, eval)
+            board.unmake()
             if val < beta:
                 beta = val
+                best = s
             if alpha >= beta:
+                if self.orderer is not None:
+                    self.orderer.cutoff(board, s, depth)
                 break
+        self.tt_store(board, depth, alpha_orig, beta_orig, beta, best)
         return beta
 
-    def max_turn(self, state, last_move, player, depth, alpha, beta, eval):
+    def max_turn(self, board, depth, alpha, beta, eval):
         """
 
-        :param state: current state
-        :param last_move: last move played
-        :param player: cureent player
+        :param board: current bit board, the player to move is the player
         :param depth: minimax depth
         :param alpha: alpha param
         :param beta: beta param
         :param eval: evaluation function used to evaluate
         :return: score for the state
         """
-
-        if depth <= 0 or self.check_small_box(self.box_won) != ".":  # or time() - s_time >= 20:
-            return eval(self,state, last_move, player)
-        succ = self.possible_moves(state, last_move)
+        self.nodes += 1
+        self.check_time()
+        if board.status() != ".":
+            return self.terminal_score(board, board.player)
+        if depth <= 0:
+            return eval(self, board, board.last_move, board.player)
+        succ = board.possible_moves()
+        entry = self.tt.probe(board.key())
+        if entry is not None:
+            value = self.tt_cutoff(entry, depth, alpha, beta)
+            if value is not None:
+                return value
+        succ = self.order_moves(board, succ, entry)
+        alpha_orig, beta_orig = alpha, beta
+        best = None
         for s in succ:
-            new_state = self.add_piece(state, s, player)
-            val = self.min_turn(new_state, s, self.opponent(player), depth - 1,
-                                alpha, beta, eval)
+            board.make(s)
+            val = self.min_turn(board, depth - 1, alpha, beta, eval)
+            board.unmake()
             if alpha < val:
                 alpha = val
+                best = s
             if alpha >= beta:
+                if self.orderer is not None:
+                    self.orderer.cutoff(board, s, depth)
                 break
+        self.tt_store(board, depth, alpha_orig, beta_orig, alpha, best)
         return alpha
 
     def valid_input(self, state, move):
@@ -393,7 +774,7 @@ class ultiTic:
                 print("#" * 40)
                 print("p1 placed X on", p1_move, "\n")
                 print_board(self.state)
-            self.box_won = self.update_box_won(self.state)
+            self.box_won = self.update_move_box(self.state, self.box_won, p1_move)
 
             game_won = self.check_small_box(self.box_won)
             if game_won != ".":
@@ -413,7 +794,7 @@ class ultiTic:
             self.state = self.add_piece(self.state, p2_move, "O")
             if not simulate:
                 print_board(self.state)
-            self.box_won = self.update_box_won(self.state)
+            self.box_won = self.update_move_box(self.state, self.box_won, p2_move)
             game_won = self.check_small_box(self.box_won)
             if game_won != ".":
                 break
@@ -433,41 +814,118 @@ class ultiTic:
 
 
 
-    def prepare_minimax(self, state, last_move):
+    def __getstate__(self):
+        """
+
+        :return: the attributes to pickle, the process pools, monte carlo trees and the memory mapped opening
+                 book stay in this process
+        """
+        attributes = self.__dict__.copy()
+        attributes["pools"] = dict()
+        attributes["trees"] = dict()
+        attributes["book"] = None
+        return attributes
+
+    def book_move(self, state, last_move, player):
         """
 
         :param state: current state
         :param last_move: last move played by opponent
-        :return: best move to be played by minimax algorithm
+        :param player: player to move
+        :return: the move of the opening book, None if there is no book or the state is not in it
         """
+        if self.book is None:
+            return None
+        return self.book.lookup(BitBoard(state, last_move, player))
 
+    def endgame_move(self, state, last_move, player, time_limit=0):
+        """
 
-        if state[last_move] == "O" or last_move<0:
-            eval_func = self.first_eval[0]
-            depth=self.first_eval[1]
-        else:
-            eval_func = self.second_eval[0]
-            depth = self.second_eval[1]
-        return self.minimax(state,last_move, "X" if state[last_move] == "O" or last_move < 0 else "O", depth, eval_func)
-    def prepare_expectimax(self, state, last_move):
+        :param state: current state
+        :param last_move: last move played by opponent
+        :param player: player to move
+        :param time_limit: seconds the solver may take, 0 for no limit
+        :return: a move of the exact solver that keeps the win or the draw, None if there is no solver, the state is
+                 not late enough or could not be solved, a lost state is left to the search that may still find the
+                 moves the opponent gets wrong
+        """
+        if self.endgame is None:
+            return None
+        solved = self.endgame.solve_state(state, last_move, player, time_limit)
+        if solved is None or solved[0] == LOSS_VALUE:
+            return None
+        return solved[1]
+
+    def known_move(self, state, last_move, player, time_limit=0):
         """
 
-                :param state: current state
-                :param last_move: last move played by opponent
-                :return: best move to be played by expectimax algorithm
-                """
+        :param state: current state
+        :param last_move: last move played by opponent
+        :param player: player to move
+        :param time_limit: seconds of the whole move, the solver may take half of it, 0 for no limit
+        :return: (move, time_limit) the move of the opening book or of the endgame solver, None if the state needs a
+                 search, and the seconds left to the search
+        """
+        start = time()
+        move = self.book_move(state, last_move, player)
+        if move is None:
+            move = self.endgame_move(state, last_move, player, time_limit / 2)
+        if time_limit:
+            time_limit = max(time_limit - (time() - start), 0)
+        return move, time_limit
+
+    def player_settings(self, state, last_move):
+        """
 
+        :param state: current state
+        :param last_move: last move played by opponent
+        :return: the player to move and the settings that were chosen for it
+        """
+        if state[last_move] == "O" or last_move < 0:
+            return "X", self.first_eval
+        return "O", self.second_eval
 
-        if state[last_move] == "O" or last_move<0:
-            eval_func = self.first_eval[0]
-            depth=self.first_eval[1]
-        else:
-            eval_func = self.second_eval[0]
-            depth = self.second_eval[1]
-        return self.expectimax(state,last_move, "X" if state[last_move] == "O" or last_move < 0 else "O", depth, eval_func)
+    def prepare_minimax(self, state, last_move):
+        """
 
+        :param state: current state
+        :param last_move: last move played by opponent
+        :return: best move to be played by minimax algorithm
+        """
+        player, settings = self.player_settings(state, last_move)
+        eval_func, depth = settings[0], settings[1]
+        time_limit = settings[2] if len(settings) > 2 else 0
+        workers = settings[3] if len(settings) > 3 else 1
+        timed = bool(time_limit)
+        # the time of the solver is taken from the time of the move
+        move, time_limit = self.known_move(state, last_move, player, time_limit)
+        if move is not None:
+            return move
+        if timed:
+            return self.iterative_deepening(state, last_move, player, depth, eval_func, time_limit, self.min_turn,
+                                            workers)
+        return self.minimax(state, last_move, player, depth, eval_func, workers)
 
+    def prepare_expectimax(self, state, last_move):
+        """
 
+        :param state: current state
+        :param last_move: last move played by opponent
+        :return: best move to be played by expectimax algorithm
+        """
+        player, settings = self.player_settings(state, last_move)
+        eval_func, depth = settings[0], settings[1]
+        time_limit = settings[2] if len(settings) > 2 else 0
+        workers = settings[3] if len(settings) > 3 else 1
+        timed = bool(time_limit)
+        # the time of the solver is taken from the time of the move
+        move, time_limit = self.known_move(state, last_move, player, time_limit)
+        if move is not None:
+            return move
+        if timed:
+            return self.iterative_deepening(state, last_move, player, depth, eval_func, time_limit,
+                                            self.expecti_min_turn, workers)
+        return self.expectimax(state, last_move, player, depth, eval_func, workers)
 
     def random_move(self, state, last_move):
         """
@@ -483,21 +941,91 @@ class ultiTic:
 
         :param state: current state
         :param move: last move played by opponent
-        :return: best move according to monte carlo algorithm
+        :return: best move according to monte carlo algorithm, the third element of the
+                 settings is a dict of MCTS options like {"parallel": "root", "workers": 4}
+                 or {"time_limit": 0.5, "max_nodes": 20000} for the anytime mode or {"rave": 5} for RAVE
+                 or {"policy": RolloutPolicy(plies=10)} for truncated rollouts
+                 or {"node_budget": 100000} to bound the memory of the tree
+                 or {"rollouts": 256} for numpy batch rollouts, only faster than one rollout per leaf
+                 from about 64 rollouts so the prompts don't offer it
         """
         if self.state[move] == "O" or move < 0:
             player = "X"
             iteration=self.first_eval[0]
             ew = self.first_eval[1]
+            options = self.first_eval[2] if len(self.first_eval) > 2 else {}
         else:
             player = "O"
             iteration = self.second_eval[0]
             ew = self.second_eval[1]
-        mont = MCTS(deepcopy(state), self, move, player,iteration,ew)
+            options = self.second_eval[2] if len(self.second_eval) > 2 else {}
+        options = dict(options)
+        time_limit = options.get("time_limit") or 0
+        known, time_limit = self.known_move(state, move, player, time_limit)
+        if known is not None:
+            # the tree of this player does not follow the game any more
+            self.trees.pop(player, None)
+            return known
+        if options.get("time_limit"):
+            # the time of the solver is taken from the time of the move
+            options["time_limit"] = time_limit
+        mont = self.trees.get(player) if options.pop("reuse", True) else None
+        if mont is None or not mont.reuse(state, move, iteration):
+            mont = MCTS(deepcopy(state), self, move, player,iteration,ew, **options)
         score, to_play = mont.solve()
+        # keep the tree for the next turn of this player
+        self.trees[player] = mont
         return to_play
 
 
+search_worker = None
+search_alpha = None
+
+
+def init_search_worker(shared_alpha):
+    """
+    create the game object of a search process
+    :param shared_alpha: best root score shared between the processes
+    :return: nothing
+    """
+    global search_worker, search_alpha
+    search_worker = ultiTic(None, None, "." * 81)
+    search_alpha = shared_alpha
+
+
+def search_root_move(state, last_move, player, move, depth, eval, turn, share_alpha, deadline, orderer=None,
+                     chance_pruning=True):
+    """
+    search one root move in a search process
+    :param state: root state
+    :param last_move: last move played before the root
+    :param player: player to move at the root
+    :param move: root move to search
+    :param depth: minimax depth of the root
+    :param eval: evaluation function
+    :param turn: name of the search function of the opponent's turn
+    :param share_alpha: True to search with the best score of the other processes as alpha
+    :param deadline: time the search has to stop at or None
+    :param orderer: move orderer of the calling game, None to only search the transposition table move first
+    :param chance_pruning: chance pruning setting of the calling game
+    :return: the move, its score, the alpha it was searched with and the searched nodes
+    """
+    # the settings of the calling game so the root move is searched the same way as in the serial search
+    search_worker.orderer = orderer
+    search_worker.chance_pruning = chance_pruning
+    search_worker.new_search()
+    search_worker.deadline = deadline
+    board = BitBoard(state, last_move, player)
+    board.make(move)
+    alpha = search_alpha.value if share_alpha else -inf
+    val = getattr(search_worker, turn)(board, depth - 1, alpha, inf, eval)
+    if share_alpha and val > alpha:
+        with search_alpha.get_lock():
+            if val > search_alpha.value:
+                search_alpha.value = val
+    return move, val, alpha, search_worker.nodes
+
+
 def user_choose(val,player):
     """
 
@@ -514,8 +1042,16 @@ def user_choose(val,player):
             print("one of the choices is not a number\n")
             h = input("player " + player + " please choose your heuristic:\n1 = h1\n2 = h2\n3 = h3\nyour choice: ")
             depth = input("player " + player + " please choose your depth:")
+        time_limit=input("player "+player+" please choose your time limit per move in seconds (0 = fixed depth):")
+        while not isfloat(time_limit) or float(time_limit) < 0:
+            print("the time limit is not a positive number\n")
+            time_limit = input("player " + player + " please choose your time limit per move in seconds (0 = fixed depth):")
+        workers=input("player "+player+" please choose the number of processes (1 = no parallel search):")
+        while not str.isdigit(workers) or int(workers) < 1:
+            print("the number of processes is not a positive number\n")
+            workers = input("player " + player + " please choose the number of processes (1 = no parallel search):")
         heur=heuristics(int(depth))
-        return (heur.get_heur(h),int(depth))
+        return (heur.get_heur(h),int(depth),float(time_limit),int(workers))
     if val=="4":
         h=input("player "+player+" please choose your heuristic:\n1 = h1\n2 = h2\n3 = h3\nyour choice: ")
         depth=input("player "+player+" please choose your depth:")
@@ -523,8 +1059,16 @@ def user_choose(val,player):
             print("one of the choices is not a number\n")
             h = input("player " + player + " please choose your heuristic:\n1 = h1\n2 = h2\n3 = h3\nyour choice: ")
             depth = input("player " + player + " please choose your depth:")
+        time_limit=input("player "+player+" please choose your time limit per move in seconds (0 = fixed depth):")
+        while not isfloat(time_limit) or float(time_limit) < 0:
+            print("the time limit is not a positive number\n")
+            time_limit = input("player " + player + " please choose your time limit per move in seconds (0 = fixed depth):")
+        workers=input("player "+player+" please choose the number of processes (1 = no parallel search):")
+        while not str.isdigit(workers) or int(workers) < 1:
+            print("the number of processes is not a positive number\n")
+            workers = input("player " + player + " please choose the number of processes (1 = no parallel search):")
         heur=heuristics(int(depth))
-        return (heur.get_heur(h),int(depth))
+        return (heur.get_heur(h),int(depth),float(time_limit),int(workers))
     if val=="5":
         iterations=input("\nchoose the number of iterations for the monte carlo learning: ")
         ew=input("\nchoose your exploration weight for the score of the monte carlo: ")
@@ -532,7 +1076,58 @@ def user_choose(val,player):
             print("one of the choices is not a number\n")
             iterations = input("\nchoose the number of iterations for the monte carlo learning: ")
             ew = input("\nchoose your exploration weight for the score of the monte carlo: ")
-        return ((int)(iterations),(float)(ew))
+        options = dict()
+        time_limit = input("\nchoose the time limit per move in seconds, the iterations are then the most "
+                           "nodes (0 = fixed iterations): ")
+        while not isfloat(time_limit) or float(time_limit) < 0:
+            print("the time limit is not a positive number\n")
+            time_limit = input("\nchoose the time limit per move in seconds, the iterations are then the most "
+                               "nodes (0 = fixed iterations): ")
+        if float(time_limit) > 0:
+            options["time_limit"] = float(time_limit)
+            options["max_nodes"] = int(iterations)
+        rave = input("\nchoose the RAVE equivalence parameter, about 5 works well (0 = plain UCT): ")
+        while not isfloat(rave) or float(rave) < 0:
+            print("the RAVE parameter is not a positive number\n")
+            rave = input("\nchoose the RAVE equivalence parameter, about 5 works well (0 = plain UCT): ")
+        if float(rave) > 0:
+            options["rave"] = float(rave)
+        policy = input("\nchoose the rollout policy:\n1 = random\n2 = prefer moves that win or block a box\n"
+                       "3 = stop after some moves and score with a heuristic\nyour choice: ")
+        while policy not in ("1", "2", "3"):
+            policy = input("\nchoose the rollout policy:\n1 = random\n2 = prefer moves that win or block a box\n"
+                           "3 = stop after some moves and score with a heuristic\nyour choice: ")
+        if policy == "2":
+            epsilon = input("\nchoose the probability of a random move: ")
+            while not isfloat(epsilon) or not 0 <= float(epsilon) <= 1:
+                print("the probability is not between 0 and 1\n")
+                epsilon = input("\nchoose the probability of a random move: ")
+            options["policy"] = RolloutPolicy(epsilon=float(epsilon))
+        elif policy == "3":
+            plies = input("\nchoose the number of moves of a rollout: ")
+            h = input("\nchoose the heuristic of the rollouts:\n1 = h1\n2 = h2\n3 = h3\nyour choice: ")
+            while not str.isdigit(plies) or h not in ("1", "2", "3"):
+                print("one of the choices is not valid\n")
+                plies = input("\nchoose the number of moves of a rollout: ")
+                h = input("\nchoose the heuristic of the rollouts:\n1 = h1\n2 = h2\n3 = h3\nyour choice: ")
+            options["policy"] = RolloutPolicy(plies=int(plies), heuristic=h)
+        budget = input("\nchoose the most nodes kept in the monte carlo tree (0 = no limit): ")
+        while not str.isdigit(budget):
+            print("the number of nodes is not a positive number\n")
+            budget = input("\nchoose the most nodes kept in the monte carlo tree (0 = no limit): ")
+        if int(budget) > 0:
+            options["node_budget"] = int(budget)
+        workers = input("\nchoose the number of processes for the monte carlo (1 = no parallel search): ")
+        while not str.isdigit(workers) or int(workers) < 1:
+            print("the number of processes is not a positive number\n")
+            workers = input("\nchoose the number of processes for the monte carlo (1 = no parallel search): ")
+        if int(workers) > 1:
+            parallel = input("\nchoose the parallel mode:\n1 = independent trees\n2 = parallel rollouts\nyour choice: ")
+            while parallel not in ("1", "2"):
+                parallel = input("\nchoose the parallel mode:\n1 = independent trees\n2 = parallel rollouts\nyour choice: ")
+            options["parallel"] = "root" if parallel == "1" else "leaf"
+            options["workers"] = int(workers)
+        return ((int)(iterations),(float)(ew),options)
 
 
 def isfloat(value):